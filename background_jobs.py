@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Background Jobs
+Runs a long computation in a daemon thread and exposes its progress
+"""
+
+import threading
+import time
+
+
+class BackgroundJob:
+    """
+    func(*args, on_progress=job.update, **kwargs) running in its own thread
+    (func must not call st.* - the thread has no script context)
+
+    Usage:
+        job = BackgroundJob(report_workbook, production_data, start, end).start()
+        ...
+        if job.done and job.error is None:
+            data = job.result
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._thread = None
+        self._progress = 0.0
+        self._stage = ''
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self) -> 'BackgroundJob':
+        """Start the thread (once), returns self"""
+        if self._thread is None:
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name=f'job-{self._func.__name__}', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.result = self._func(*self._args, on_progress=self.update, **self._kwargs)
+            self.update(1.0, self._stage)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.time()
+
+    def update(self, progress: float, stage: str = None):
+        """Progress callback: fraction done (0..1) and optional stage text"""
+        with self._lock:
+            self._progress = min(max(float(progress), 0.0), 1.0)
+            if stage is not None:
+                self._stage = stage
+
+    @property
+    def progress(self) -> float:
+        with self._lock:
+            return self._progress
+
+    @property
+    def stage(self) -> str:
+        with self._lock:
+            return self._stage
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since start (until finish once done)"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
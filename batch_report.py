@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Batch KPI Report
+Command-line report of every daily KPI of a date range (Excel or Parquet)
+
+Usage:
+    python batch_report.py --period 2025-Q1 --output bao_cao_2025_Q1.xlsx
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from sheet_sources import (
+    DEFAULT_SHEET_URL,
+    DEFAULT_CREDENTIALS_FILE,
+    authorize_service_account,
+    load_sheets,
+    load_snapshot,
+    save_snapshot
+)
+from production_capacity_helper import (
+    DEPT_SX1,
+    DEPT_SX2,
+    build_pky_part_master,
+    calculate_production_capacity_range,
+    classify_machines_by_department
+)
+from qc_capacity_helper import calculate_quality_control_capacity_range
+from day_index import range_slice
+from excel_export import write_excel
+from kpi_trends import rollup_daily_kpis
+from kpi_engine import (
+    SheetFrames,
+    ProductionData,
+    prepare_production_data,
+    inventory_metrics,
+    overdue_metrics,
+    overdue_orders
+)
+
+
+REPORT_FORMATS = ('excel', 'parquet')
+
+# Report part key (Parquet file name) -> Excel sheet name
+REPORT_SHEETS = {
+    'tong_hop': 'Tổng hợp',
+    'sx_theo_ngay': 'Sản xuất theo ngày',
+    'kt_theo_ngay': 'Kiểm tra theo ngày',
+    'may_theo_ngay': 'Máy theo bộ phận',
+    'sx_theo_thang': 'Sản xuất theo tháng',
+    'kt_theo_thang': 'Kiểm tra theo tháng',
+    'don_qua_han_sx': 'Đơn quá hạn SX',
+    'don_qua_han_pkt': 'Đơn quá hạn PKT',
+}
+
+# Computed column -> Excel header
+REPORT_COLUMN_LABELS = {
+    'date': 'Ngày',
+    'so_ngay': 'Số ngày',
+    'san_luong': 'Sản lượng',
+    'tong_thoi_gian_gia_cong': 'Thời gian gia công (phút)',
+    'may_12h': 'Máy 12h',
+    'may_8h': 'Máy 8h',
+    'may_dung': 'Máy dừng',
+    'thoi_gian_may_chay': 'Thời gian máy chạy (phút)',
+    'thoi_gian_may_dung': 'Thời gian máy dừng (phút)',
+    'cs_tong': 'CS tổng (%)',
+    'cs_truc_tiep': 'CS trực tiếp (%)',
+    'A_tong': 'Người làm 12h',
+    'A_truc_tiep': 'Người làm 12h trực tiếp',
+    'B_tong': 'Người làm 8h',
+    'practical_employees_count': 'Số người thực tế',
+    'thoi_gian_100_nguoi': 'Thời gian 100% người (phút)',
+    'thoi_gian_nguoi_truc_tiep': 'Thời gian người trực tiếp (phút)',
+    'total_completion_time': 'Thời gian hoàn thành (phút)',
+    'department': 'Bộ phận',
+    'danh_sach_may_dung': 'Danh sách máy dừng',
+    'chi_tieu': 'Chỉ tiêu',
+    'gia_tri': 'Giá trị',
+    'orkd': 'ORKD',
+    'kh': 'KH',
+    'so_luong': 'Số lượng ĐH',
+    'th_moi_khach_hang': 'TH mới khách hàng',
+    'trang_thai': 'Trạng thái',
+}
+
+# Per-worker prepared data (set once per process by _init_worker)
+_worker_data = None
+
+
+def split_days(start_date, end_date, chunks: int) -> list:
+    """
+    Split [start_date, end_date] into at most `chunks` contiguous (start, end) day ranges
+
+    Every chunk is a range the vectorized range calculators handle in one pass.
+    """
+    days = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize())
+    if len(days) == 0:
+        return []
+    chunk_size = -(-len(days) // max(1, chunks))
+    return [
+        (days[i], days[min(i + chunk_size, len(days)) - 1])
+        for i in range(0, len(days), chunk_size)
+    ]
+
+
+def compute_day_chunk(data: ProductionData, start_date, end_date) -> dict:
+    """
+    Every daily KPI of one chunk
+
+    Returns:
+        {'sx': SX range rows, 'qc': QC range rows, 'machines': máy 12h / 8h / dừng per department}
+    """
+    frames = data.frames
+
+    sx = pd.DataFrame()
+    if data.phtcv_times is not None:
+        sx = calculate_production_capacity_range(
+            data.phtcv_days['frame'], frames.gckt, data.gckt_times, frames.machine_list,
+            start_date, end_date, phtcv_times=data.phtcv_times
+        )
+
+    qc = calculate_quality_control_capacity_range(
+        frames.giao_kho_vp, frames.shift_schedule, frames.hr_daily_head_counts,
+        frames.thoi_gian_hoan_thanh, start_date, end_date
+    )
+
+    machine_rows = []
+    if data.phtcv_times is not None:
+        chunk_rows = range_slice(data.phtcv_days, start_date, end_date)
+        chunk_times = data.phtcv_times.loc[chunk_rows.index]
+        for day, day_times in chunk_times.groupby('day', sort=True):
+            classified = classify_machines_by_department(day_times, frames.machine_list)
+            for department in (DEPT_SX1, DEPT_SX2):
+                machines = classified[department]
+                machine_rows.append({
+                    'date': day,
+                    'department': department,
+                    'may_12h': len(machines['may_12h']),
+                    'may_8h': len(machines['may_8h']),
+                    'may_dung': len(machines['may_dung']),
+                    'danh_sach_may_dung': ', '.join(machines['may_dung']),
+                })
+
+    return {'sx': sx, 'qc': qc, 'machines': pd.DataFrame(machine_rows)}
+
+
+def _init_worker(data: ProductionData):
+    """Process pool initializer: the prepared data is sent once per worker, not per chunk"""
+    global _worker_data
+    _worker_data = data
+
+
+def _compute_chunk_in_worker(bounds: tuple) -> dict:
+    return compute_day_chunk(_worker_data, *bounds)
+
+
+def compute_daily_kpis(data: ProductionData, start_date, end_date, workers: int = None,
+                       chunks: int = None, on_progress=None) -> dict:
+    """
+    Daily SX / QC / machine KPIs of [start_date, end_date], chunks spread across a process pool
+
+    Args:
+        data: prepare_production_data result
+        workers: Processes (default: all cores); 1 computes in this process
+        chunks: Number of day ranges (default: 4 per worker)
+        on_progress: Optional callback(done_chunks, total_chunks) after every chunk
+
+    Returns:
+        {'sx', 'qc', 'machines'} DataFrames sorted by date
+    """
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per worker so a slow chunk (busy month) does not idle the others
+    chunks = split_days(start_date, end_date, chunks or workers * 4)
+
+    results = []
+    if workers == 1 or len(chunks) <= 1:
+        for bounds in chunks:
+            results.append(compute_day_chunk(data, *bounds))
+            if on_progress is not None:
+                on_progress(len(results), len(chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as executor:
+            for result in executor.map(_compute_chunk_in_worker, chunks):
+                results.append(result)
+                if on_progress is not None:
+                    on_progress(len(results), len(chunks))
+
+    daily = {}
+    for part in ('sx', 'qc', 'machines'):
+        frames = [result[part] for result in results if not result[part].empty]
+        daily[part] = (
+            pd.concat(frames, ignore_index=True).sort_values('date', kind='stable').reset_index(drop=True)
+            if frames else pd.DataFrame()
+        )
+    return daily
+
+
+def build_summary(daily: dict, start_date, end_date, frames: SheetFrames = None) -> pd.DataFrame:
+    """
+    Tổng hợp sheet: range totals / averages, plus hàng tồn and quá hạn when KHSX is loaded
+    """
+    sx, qc = daily['sx'], daily['qc']
+    rows = [
+        ('Từ ngày', pd.Timestamp(start_date).strftime('%d/%m/%Y')),
+        ('Đến ngày', pd.Timestamp(end_date).strftime('%d/%m/%Y')),
+        ('Sản xuất - Số ngày có dữ liệu', len(sx)),
+        ('Sản xuất - Tổng sản lượng', int(sx['san_luong'].sum()) if not sx.empty else 0),
+        ('Sản xuất - CS tổng trung bình (%)', round(float(sx['cs_tong'].mean()), 2) if not sx.empty else 0.0),
+        ('Sản xuất - CS trực tiếp trung bình (%)', round(float(sx['cs_truc_tiep'].mean()), 2) if not sx.empty else 0.0),
+        ('Kiểm tra - Số ngày có dữ liệu', len(qc)),
+        ('Kiểm tra - Tổng sản lượng', int(qc['san_luong'].sum()) if not qc.empty else 0),
+        ('Kiểm tra - CS tổng trung bình (%)', round(float(qc['cs_tong'].mean()), 2) if not qc.empty else 0.0),
+        ('Kiểm tra - CS trực tiếp trung bình (%)', round(float(qc['cs_truc_tiep'].mean()), 2) if not qc.empty else 0.0),
+    ]
+
+    if frames is not None and frames.khsx is not None:
+        # KHSX is a current state, not a daily series: reported as of the load
+        inventory = inventory_metrics(frames, sheet_url=None)
+        overdue = overdue_metrics(frames, sheet_url=None)
+        rows += [
+            ('Hàng tồn SX (hiện tại)', inventory.total_sx),
+            ('Hàng tồn PKT (hiện tại)', inventory.total_pkt),
+            ('Quá hạn / tới hạn SX (hiện tại)', overdue.total_sx),
+            ('Quá hạn / tới hạn PKT (hiện tại)', overdue.total_pkt),
+        ]
+
+    return pd.DataFrame(rows, columns=['chi_tieu', 'gia_tri'])
+
+
+def build_report(daily: dict, start_date, end_date, frames: SheetFrames = None) -> dict:
+    """Report parts keyed like REPORT_SHEETS (computed column names)"""
+    # Quá hạn / tới hạn order lists are a current state of KHSX, like the Tổng hợp figures
+    orders = overdue_orders(frames) if frames is not None else {'sx': pd.DataFrame(), 'pkt': pd.DataFrame()}
+    return {
+        'tong_hop': build_summary(daily, start_date, end_date, frames),
+        'sx_theo_ngay': daily['sx'],
+        'kt_theo_ngay': daily['qc'],
+        'may_theo_ngay': daily['machines'],
+        'sx_theo_thang': rollup_daily_kpis(daily['sx'], 'M') if not daily['sx'].empty else pd.DataFrame(),
+        'kt_theo_thang': rollup_daily_kpis(daily['qc'], 'M') if not daily['qc'].empty else pd.DataFrame(),
+        'don_qua_han_sx': orders['sx'],
+        'don_qua_han_pkt': orders['pkt'],
+    }
+
+
+def write_excel_report(report: dict, output):
+    """One worksheet per report part, Vietnamese headers, dd/mm/yyyy dates (output: path or binary stream)"""
+    write_excel(
+        {
+            sheet_name: report[part].rename(columns=REPORT_COLUMN_LABELS)
+            for part, sheet_name in REPORT_SHEETS.items()
+        },
+        output
+    )
+
+
+def report_workbook(data: ProductionData, start_date, end_date, workers: int = 1,
+                    chunks: int = 12, on_progress=None) -> bytes:
+    """
+    Full report of [start_date, end_date] as .xlsx bytes (dashboard "Báo cáo đầy đủ" export)
+
+    Args:
+        data: prepare_production_data result
+        workers, chunks: See compute_daily_kpis (one chunk per progress step)
+        on_progress: Optional callback(fraction, stage)
+    """
+    def report(fraction, stage):
+        if on_progress is not None:
+            on_progress(fraction, stage)
+
+    report(0.0, "Đang tính KPI theo ngày...")
+    daily = compute_daily_kpis(
+        data, start_date, end_date, workers=workers, chunks=chunks,
+        on_progress=lambda done, total: report(0.8 * done / total, f"Đang tính KPI theo ngày ({done}/{total})...")
+    )
+    report(0.8, "Đang tính hàng tồn và đơn quá hạn...")
+    parts = build_report(daily, start_date, end_date, data.frames)
+    report(0.9, "Đang ghi file Excel...")
+    output = BytesIO()
+    write_excel_report(parts, output)
+    return output.getvalue()
+
+
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+
+
+def parquet_engine_available() -> bool:
+    """True if pandas can write Parquet (pyarrow or fastparquet installed)"""
+    return any(importlib.util.find_spec(engine) is not None for engine in PARQUET_ENGINES)
+
+
+def write_parquet_report(report: dict, output_dir: str):
+    """One <part>.parquet file per report part (needs pyarrow or fastparquet)"""
+    os.makedirs(output_dir, exist_ok=True)
+    for part, df in report.items():
+        # Object columns with mixed values are stored as strings
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].astype(str)
+        df.to_parquet(os.path.join(output_dir, f'{part}.parquet'), index=False)
+
+
+def parse_report_range(args) -> tuple:
+    """(start, end) days from --period ('2025-03', '2025-Q1', '2025') or --start / --end"""
+    if args.period:
+        period = args.period.strip().upper()
+        freq = 'Q' if 'Q' in period else ('Y' if len(period) == 4 else 'M')
+        period = pd.Period(period, freq=freq)
+        return period.start_time.normalize(), period.end_time.normalize()
+    if not args.start:
+        raise ValueError("Cần --period hoặc --start")
+    start_date = pd.Timestamp(args.start).normalize()
+    end_date = pd.Timestamp(args.end).normalize() if args.end else pd.Timestamp.today().normalize()
+    if end_date < start_date:
+        raise ValueError("--end phải sau --start")
+    return start_date, end_date
+
+
+def load_report_sheets(args) -> dict:
+    """Sheets from --snapshot, or live from Google Sheets (optionally saved with --save-snapshot)"""
+    if args.snapshot:
+        print(f"Đọc snapshot: {args.snapshot}")
+        return load_snapshot(args.snapshot)
+
+    credentials_file = args.credentials or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', DEFAULT_CREDENTIALS_FILE)
+    client = authorize_service_account(credentials_file)
+
+    def on_loaded(sheet, df, error):
+        if error is not None:
+            print(f"  ⚠️ Lỗi khi tải {sheet}: {error}", file=sys.stderr)
+        else:
+            print(f"  {sheet}: {len(df)} dòng")
+
+    print("Đọc Google Sheets...")
+    data = load_sheets(client, args.sheet_url, on_loaded=on_loaded)
+    if args.save_snapshot:
+        save_snapshot(data, args.save_snapshot)
+        print(f"Đã lưu snapshot: {args.save_snapshot}")
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Báo cáo KPI theo ngày cho một khoảng thời gian")
+    parser.add_argument('--period', help="Tháng '2025-03', quý '2025-Q1' hoặc năm '2025'")
+    parser.add_argument('--start', help="Từ ngày (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Đến ngày (YYYY-MM-DD, mặc định hôm nay)")
+    parser.add_argument('--snapshot', help="Đọc dữ liệu từ thư mục snapshot thay vì Google Sheets")
+    parser.add_argument('--save-snapshot', help="Lưu dữ liệu đã đọc vào thư mục snapshot")
+    parser.add_argument('--credentials', help="Service account JSON (mặc định GOOGLE_APPLICATION_CREDENTIALS)")
+    parser.add_argument('--sheet-url', default=DEFAULT_SHEET_URL)
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='excel')
+    parser.add_argument('--output', help="File .xlsx hoặc thư mục Parquet")
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định: tất cả CPU)")
+    args = parser.parse_args(argv)
+
+    try:
+        start_date, end_date = parse_report_range(args)
+    except ValueError as e:
+        parser.error(str(e))
+    # Fail before loading every sheet and computing the whole range
+    if args.format == 'parquet' and not parquet_engine_available():
+        parser.error("--format parquet cần pyarrow hoặc fastparquet (pip install pyarrow)")
+
+    t0 = time.time()
+    data = load_report_sheets(args)
+    frames = SheetFrames.from_sheets(data)
+    part_master = build_pky_part_master(frames.pky) if frames.pky is not None else None
+    production_data = prepare_production_data(frames, part_master)
+    t_load = time.time() - t0
+
+    t0 = time.time()
+    daily = compute_daily_kpis(production_data, start_date, end_date, workers=args.workers)
+    report = build_report(daily, start_date, end_date, frames)
+    t_compute = time.time() - t0
+
+    output = args.output or 'bao_cao_kpi_{}_{}'.format(start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
+    if args.format == 'excel':
+        if not output.lower().endswith('.xlsx'):
+            output += '.xlsx'
+        write_excel_report(report, output)
+    else:
+        write_parquet_report(report, output)
+
+    print(
+        f"✅ {start_date:%d/%m/%Y} - {end_date:%d/%m/%Y}: "
+        f"{len(daily['sx'])} ngày SX, {len(daily['qc'])} ngày Kiểm tra -> {output} "
+        f"(tải {t_load:.1f}s, tính {t_compute:.1f}s)"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,16 +7,40 @@ Calculates all 4 inventory metrics in ONE API call instead of 4
 import gspread
 from google.oauth2.service_account import Credentials
 import pandas as pd
+import numpy as np
 from datetime import datetime
 
+from span_log import traced
+from khsx_order_flags import (
+    read_khsx_frame, add_order_flags, has_flags,
+    FLAG_RRC, SX_INVENTORY, PKT_INVENTORY, KHSX_IDX_KH
+)
 
+# Order state codes (one per KHSX row)
+ORDER_STATE_DONE = 0     # Not in any inventory (delivered / not started)
+ORDER_STATE_RRC_SX = 1   # RRC, waiting in Sản xuất
+ORDER_STATE_EXT_SX = 2   # Hàng ngoài, waiting in Sản xuất
+ORDER_STATE_RRC_PKT = 3  # RRC, waiting in Kiểm tra
+ORDER_STATE_EXT_PKT = 4  # Hàng ngoài, waiting in Kiểm tra
+
+# Order state -> result key
+ORDER_STATE_METRICS = {
+    ORDER_STATE_RRC_SX: 'rrc_inventory',
+    ORDER_STATE_EXT_SX: 'external_inventory',
+    ORDER_STATE_RRC_PKT: 'rrc_pkt_inventory',
+    ORDER_STATE_EXT_PKT: 'external_pkt_inventory',
+}
+
+
+@traced(rows_arg='df_khsx', sheet='KHSX')
 def calculate_all_inventory_metrics(
     sheet_url: str,
     credentials_file: str = None,
     gspread_client=None,
     worksheet_name: str = 'KHSX_KHSX',
     header_row: int = 4,
-    data_start_row: int = 5
+    data_start_row: int = 5,
+    df_khsx: pd.DataFrame = None
 ) -> dict:
     """
     Calculate ALL inventory metrics in one pass:
@@ -25,125 +49,83 @@ def calculate_all_inventory_metrics(
     - RRC PKT inventory (Kiểm tra)
     - External PKT inventory (Kiểm tra)
     
-    Returns dict with all 4 metrics
+    Returns dict with all 4 metrics, plus breakdowns (one column per metric):
+    - 'inventory_by_customer': DataFrame indexed by KH
+    - 'inventory_by_due_month': DataFrame indexed by month of TH mới khách hàng
     
     Args:
         sheet_url: Google Sheets URL
         credentials_file: Path to JSON credentials (optional, for local)
         gspread_client: Pre-authenticated gspread client (optional, for cloud)
+        df_khsx: Already loaded KHSX frame (optional, see khsx_order_flags.read_khsx_frame);
+            the sheet is not read again when given
     """
-    # Use provided client OR authenticate with file
-    if gspread_client is not None:
-        client = gspread_client
-    elif credentials_file:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_file(credentials_file, scopes=scopes)
-        client = gspread.authorize(creds)
+    if df_khsx is None:
+        # Use provided client OR authenticate with file
+        if gspread_client is not None:
+            client = gspread_client
+        elif credentials_file:
+            scopes = ['https://www.googleapis.com/auth/spreadsheets']
+            creds = Credentials.from_service_account_file(credentials_file, scopes=scopes)
+            client = gspread.authorize(creds)
+        else:
+            raise ValueError("Either gspread_client or credentials_file must be provided")
+        
+        # Read data ONCE
+        df = read_khsx_frame(client, sheet_url, worksheet_name, header_row, data_start_row)
+    elif 'order_flags' not in df_khsx.columns:
+        df = add_order_flags(df_khsx)
     else:
-        raise ValueError("Either gspread_client or credentials_file must be provided")
-    
-    spreadsheet = client.open_by_url(sheet_url)
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    
-    # Read data ONCE
-    all_data = worksheet.get_all_values()
-    headers = all_data[header_row - 1]
-    data_rows = all_data[data_start_row - 1:]
-    df = pd.DataFrame(data_rows, columns=headers)
-    
-    # Column indices
-    idx_so_luong = 10        # K (col 11): Số lượng ĐH
-    idx_kh = 11              # L (col 12): KH
-    idx_ngay_giao_phoi = 16  # Q (col 17): Ngày giao phôi sx AMJ
-    idx_field_w = 22         # W (col 23): Field W
-    idx_ngay_giao_qlcl = 40  # AO (col 41): Ngày giao QLCL
-    idx_field_as = 44        # AS (col 45): Field AS
-    
-    results = {}
-    
-    # =====================================================================
-    # RRC Inventory (Sản xuất)
-    # Excel: AO = empty, Q ≠ empty (ISNUMBER), L = RRC
-    # ISNUMBER means Q must be a valid date, not just non-empty string
-    # =====================================================================
-    
-    # Parse Q as date (ISNUMBER check)
-    df['q_parsed'] = pd.to_datetime(
-        df.iloc[:, idx_ngay_giao_phoi],
-        format='%d/%m/%Y',
-        errors='coerce'
-    )
-    
-    mask_rrc_sx = (
-        (df.iloc[:, idx_kh].astype(str).str.strip() == 'RRC') &
-        (df['q_parsed'].notna()) &  # ISNUMBER - must be valid date
-        (df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() == '')
-    )
-    
-    df_rrc_sx = df[mask_rrc_sx].copy()
-    df_rrc_sx['So_luong'] = pd.to_numeric(
-        df_rrc_sx.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    results['rrc_inventory'] = int(df_rrc_sx['So_luong'].sum())
+        df = df_khsx
     
     # =====================================================================
-    # External Inventory (Sản xuất)
-    # Excel: AO = empty, Q ≠ empty (ISNUMBER), L ≠ RRC
+    # Classify every row ONCE into an order state (from the status flags)
+    # Sản xuất (SX):  AO = empty, Q = valid date (ISNUMBER)
+    # Kiểm tra (PKT): AO ≠ empty, AS = empty, W = empty
+    # L = RRC -> RRC, otherwise -> Hàng ngoài
     # =====================================================================
-    mask_ext_sx = (
-        (df.iloc[:, idx_kh].astype(str).str.strip() != 'RRC') &
-        (df['q_parsed'].notna()) &  # ISNUMBER - must be valid date
-        (df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() == '')
+    flags = df['order_flags'].to_numpy()
+    is_rrc = has_flags(flags, FLAG_RRC)
+    in_sx = has_flags(flags, *SX_INVENTORY)
+    in_pkt = has_flags(flags, *PKT_INVENTORY)
+    
+    order_state = np.select(
+        [in_sx & is_rrc, in_sx & ~is_rrc, in_pkt & is_rrc, in_pkt & ~is_rrc],
+        [ORDER_STATE_RRC_SX, ORDER_STATE_EXT_SX, ORDER_STATE_RRC_PKT, ORDER_STATE_EXT_PKT],
+        default=ORDER_STATE_DONE
     )
     
-    df_ext_sx = df[mask_ext_sx].copy()
-    df_ext_sx['So_luong'] = pd.to_numeric(
-        df_ext_sx.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    results['external_inventory'] = int(df_ext_sx['So_luong'].sum())
+    kh = df.iloc[:, KHSX_IDX_KH].astype(str).str.strip()
+    so_luong = df['So_luong_num']
+    due_month = df['TH_date'].dt.to_period('M')
     
     # =====================================================================
-    # RRC PKT Inventory (Kiểm tra)
-    # Excel: AO ≠ empty, AS = empty, W = empty, L = RRC
+    # ONE groupby-sum; totals and breakdowns are reductions of its result
     # =====================================================================
-    mask_rrc_pkt = (
-        (df.iloc[:, idx_kh].astype(str).str.strip() == 'RRC') &
-        (df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() != '') &
-        (df.iloc[:, idx_field_as].astype(str).str.strip() == '') &
-        (df.iloc[:, idx_field_w].astype(str).str.strip() == '')
+    in_inventory = order_state != ORDER_STATE_DONE
+    grouped = so_luong[in_inventory].groupby(
+        [order_state[in_inventory], kh[in_inventory], due_month[in_inventory]],
+        dropna=False
+    ).sum()
+    grouped.index.names = ['order_state', 'KH', 'due_month']
+    grouped = grouped.rename(index=ORDER_STATE_METRICS, level='order_state')
+    
+    totals = grouped.groupby(level='order_state').sum()
+    results = {metric: int(totals.get(metric, 0)) for metric in ORDER_STATE_METRICS.values()}
+    
+    metric_columns = list(ORDER_STATE_METRICS.values())
+    results['inventory_by_customer'] = (
+        grouped.groupby(level=['KH', 'order_state']).sum()
+        .unstack('order_state', fill_value=0)
+        .reindex(columns=metric_columns, fill_value=0)
     )
-    
-    df_rrc_pkt = df[mask_rrc_pkt].copy()
-    df_rrc_pkt['So_luong'] = pd.to_numeric(
-        df_rrc_pkt.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    results['rrc_pkt_inventory'] = int(df_rrc_pkt['So_luong'].sum())
-    
-    # =====================================================================
-    # External PKT Inventory (Kiểm tra)
-    # Excel: AO ≠ empty, AS = empty, W = empty, L ≠ RRC
-    # =====================================================================
-    mask_ext_pkt = (
-        (df.iloc[:, idx_kh].astype(str).str.strip() != 'RRC') &
-        (df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() != '') &
-        (df.iloc[:, idx_field_as].astype(str).str.strip() == '') &
-        (df.iloc[:, idx_field_w].astype(str).str.strip() == '')
+    results['inventory_by_due_month'] = (
+        grouped.groupby(level=['due_month', 'order_state'], dropna=False).sum()
+        .unstack('order_state', fill_value=0)
+        .reindex(columns=metric_columns, fill_value=0)
+        .sort_index()
     )
     
-    df_ext_pkt = df[mask_ext_pkt].copy()
-    df_ext_pkt['So_luong'] = pd.to_numeric(
-        df_ext_pkt.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    results['external_pkt_inventory'] = int(df_ext_pkt['So_luong'].sum())
-    
     return results
 
 
@@ -175,7 +157,7 @@ if __name__ == "__main__":
     print()
     print(f"Total SX:  {results['rrc_inventory'] + results['external_inventory']:>6,}")
     print(f"Total PKT: {results['rrc_pkt_inventory'] + results['external_pkt_inventory']:>6,}")
-    print(f"Grand Total: {sum(results.values()):>6,}")
+    print(f"Grand Total: {sum(results[m] for m in ORDER_STATE_METRICS.values()):>6,}")
     print()
     print("="*70)
     print(f"[FAST] Total time: {elapsed:.2f} seconds")
@@ -7,8 +7,19 @@ Calculates all metrics in one pass to avoid multiple Google Sheets reads
 import gspread
 from google.oauth2.service_account import Credentials
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 
+from span_log import traced
+from khsx_order_flags import (
+    read_khsx_frame, add_order_flags, has_flags,
+    FLAG_RRC, FLAG_TH_DATE, SX_OVERDUE_PLAN, PKT_INVENTORY, KHSX_IDX_ORKD
+)
+
+
+SEGMENT_RRC = 'RRC'
+SEGMENT_EXTERNAL = 'external'
+
 
 def authenticate_google_sheets(credentials_file: str):
     """Authenticate with Google Sheets API"""
@@ -17,13 +28,147 @@ def authenticate_google_sheets(credentials_file: str):
     return gspread.authorize(creds)
 
 
+def build_overdue_horizon_index(th_dates: pd.Series, so_luong: pd.Series, kh: pd.Series) -> dict:
+    """
+    Sort each KH segment's orders by TH date ONCE and build prefix sums of So_luong
+    
+    Orders without a valid TH date are left out (SUMIF never counts them).
+    
+    Args:
+        th_dates: Parsed TH mới khách hàng (datetime64, NaT allowed)
+        so_luong: Số lượng ĐH (int)
+        kh: Stripped KH values
+    
+    Returns:
+        dict: {SEGMENT_RRC / SEGMENT_EXTERNAL: {'dates': sorted datetime64 array,
+                                               'cumsum': int64 prefix sums}}
+    """
+    has_date = th_dates.notna().to_numpy()
+    is_rrc = (kh == 'RRC').to_numpy()
+    dates = th_dates.to_numpy(dtype='datetime64[ns]')
+    quantities = so_luong.to_numpy(dtype=np.int64)
+    
+    index = {}
+    for segment, in_segment in [(SEGMENT_RRC, is_rrc), (SEGMENT_EXTERNAL, ~is_rrc)]:
+        selected = has_date & in_segment
+        order = np.argsort(dates[selected], kind='stable')
+        index[segment] = {
+            'dates': dates[selected][order],
+            'cumsum': np.cumsum(quantities[selected][order]),
+        }
+    return index
+
+
+def quantity_due_by(horizon_index: dict, segment: str, threshold) -> int:
+    """SUMIF(TH <= threshold) of one segment, as a searchsorted lookup"""
+    entry = horizon_index[segment]
+    position = np.searchsorted(entry['dates'], np.datetime64(pd.Timestamp(threshold), 'ns'), side='right')
+    return int(entry['cumsum'][position - 1]) if position > 0 else 0
+
+
+def total_quantity(horizon_index: dict, segment: str) -> int:
+    """Sum of So_luong of one segment (all orders with a valid TH date)"""
+    cumsum = horizon_index[segment]['cumsum']
+    return int(cumsum[-1]) if len(cumsum) else 0
+
+
+def overdue_horizon_curve(horizon_index: dict, today, max_days: int = 60) -> pd.DataFrame:
+    """
+    Quantity due within N days (TH <= today + N) for N = 0..max_days
+    
+    Returns:
+        DataFrame with columns 'N', 'RRC', 'Hàng ngoài', 'Tổng'
+    """
+    days = np.arange(max_days + 1)
+    thresholds = np.datetime64(pd.Timestamp(today).normalize(), 'ns') + days.astype('timedelta64[D]')
+    
+    curve = pd.DataFrame({'N': days})
+    for segment, label in [(SEGMENT_RRC, 'RRC'), (SEGMENT_EXTERNAL, 'Hàng ngoài')]:
+        entry = horizon_index[segment]
+        positions = np.searchsorted(entry['dates'], thresholds, side='right')
+        padded = np.concatenate([[0], entry['cumsum']])
+        curve[label] = padded[positions]
+    curve['Tổng'] = curve['RRC'] + curve['Hàng ngoài']
+    return curve
+
+
+def _distinct_orders(df: pd.DataFrame, mask) -> pd.Index:
+    """Row labels of the first occurrence of each ORKD among the rows selected by mask"""
+    df_selected = df[mask]
+    return df_selected.drop_duplicates(subset=[df_selected.columns[KHSX_IDX_ORKD]], keep='first').index
+
+
+def _prepared_khsx(df_khsx: pd.DataFrame) -> pd.DataFrame:
+    """KHSX frame with order flags (added here if the frame was not loaded with them)"""
+    return df_khsx if 'order_flags' in df_khsx.columns else add_order_flags(df_khsx)
+
+
+def select_overdue_plan_rows(df: pd.DataFrame, today) -> tuple:
+    """
+    Row labels of the orders the quá hạn / tới hạn metrics are summed over
+    
+    - SX AMJ: Q not empty, AO empty, TH <= today + 10 (VBA filter)
+    - PKT AMJ: AO filled, AS & W empty, TH <= today + 8, first row of each ORKD
+    
+    Returns:
+        (sx_rows, pkt_rows) as pd.Index
+    """
+    flags = df['order_flags'].to_numpy()
+    th_dates = df['TH_date']
+    
+    mask_sx = has_flags(flags, *SX_OVERDUE_PLAN)
+    mask_sx_th = (th_dates <= pd.Timestamp(today + timedelta(days=10))).to_numpy()  # NaT compares as False
+    sx_rows = df.index[mask_sx & mask_sx_th]
+    
+    mask_pkt = has_flags(flags, *PKT_INVENTORY)
+    mask_pkt_th = (th_dates <= pd.Timestamp(today + timedelta(days=8))).to_numpy()
+    pkt_rows = _distinct_orders(df, mask_pkt & mask_pkt_th)
+    return sx_rows, pkt_rows
+
+
+def overdue_order_list(df_khsx: pd.DataFrame, today=None) -> dict:
+    """
+    Order lists behind the quá hạn / tới hạn metrics (one row per order, TH order)
+    
+    Args:
+        df_khsx: Loaded KHSX frame
+        today: Reference day (default: today)
+    
+    Returns:
+        {'sx': DataFrame, 'pkt': DataFrame} with columns 'orkd', 'kh', 'so_luong',
+        'th_moi_khach_hang' and 'trang_thai' ('Quá hạn' / 'Tới hạn', same thresholds as
+        section 3: SX today + 5, PKT today + 3)
+    """
+    df = _prepared_khsx(df_khsx)
+    today = today or datetime.now().date()
+    sx_rows, pkt_rows = select_overdue_plan_rows(df, today)
+    
+    order_lists = {}
+    for key, rows, offset in [('sx', sx_rows, 5), ('pkt', pkt_rows, 3)]:
+        th_dates = df.loc[rows, 'TH_date']
+        orders = pd.DataFrame({
+            'orkd': df.loc[rows].iloc[:, KHSX_IDX_ORKD].astype(str).str.strip(),
+            'kh': np.where(has_flags(df.loc[rows, 'order_flags'], FLAG_RRC), 'RRC', 'Hàng ngoài'),
+            'so_luong': df.loc[rows, 'So_luong_num'],
+            'th_moi_khach_hang': th_dates,
+            'trang_thai': np.where(
+                (th_dates <= pd.Timestamp(today + timedelta(days=offset))).to_numpy(), 'Quá hạn', 'Tới hạn'
+            ),
+        })
+        order_lists[key] = orders.sort_values('th_moi_khach_hang', kind='stable').reset_index(drop=True)
+    return order_lists
+
+
+@traced(rows_arg='df_khsx', sheet='KHSX')
 def calculate_all_overdue_metrics(
     sheet_url: str,
     credentials_file: str = None,
     gspread_client=None,
     worksheet_name: str = 'KHSX_KHSX',
     header_row: int = 4,
-    data_start_row: int = 5
+    data_start_row: int = 5,
+    horizon_days: int = None,
+    df_khsx: pd.DataFrame = None
 ) -> dict:
     """
     Calculate ALL overdue/due soon metrics in one pass:
@@ -36,113 +181,49 @@ def calculate_all_overdue_metrics(
         sheet_url: Google Sheets URL
         credentials_file: Path to JSON credentials (optional, for local)
         gspread_client: Pre-authenticated gspread client (optional, for cloud)
+        horizon_days: If set, also return 'sx_horizon_curve' and 'pkt_horizon_curve'
+            (DataFrames, see overdue_horizon_curve) for N = 0..horizon_days
+        df_khsx: Already loaded KHSX frame (optional, see khsx_order_flags.read_khsx_frame);
+            the sheet is not read again when given
     """
-    # Use provided client OR authenticate with file
-    if gspread_client is not None:
-        client = gspread_client
-    elif credentials_file:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_file(credentials_file, scopes=scopes)
-        client = gspread.authorize(creds)
+    if df_khsx is None:
+        # Use provided client OR authenticate with file
+        if gspread_client is not None:
+            client = gspread_client
+        elif credentials_file:
+            scopes = ['https://www.googleapis.com/auth/spreadsheets']
+            creds = Credentials.from_service_account_file(credentials_file, scopes=scopes)
+            client = gspread.authorize(creds)
+        else:
+            raise ValueError("Either gspread_client or credentials_file must be provided")
+        
+        # Read data ONCE
+        df = read_khsx_frame(client, sheet_url, worksheet_name, header_row, data_start_row)
     else:
-        raise ValueError("Either gspread_client or credentials_file must be provided")
-    
-    spreadsheet = client.open_by_url(sheet_url)
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    
-    # Read data ONCE
-    all_data = worksheet.get_all_values()
-    headers = all_data[header_row - 1]
-    data_rows = all_data[data_start_row - 1:]
-    df = pd.DataFrame(data_rows, columns=headers)
-    
-    # Column indices
-    idx_so_luong = 10        # K
-    idx_kh = 11              # L
-    idx_thoi_han = 13        # N
-    idx_ngay_giao_phoi = 16  # Q
-    idx_field_w = 22         # W
-    idx_ngay_giao_qlcl = 40  # AO
-    idx_field_as = 44        # AS
+        df = _prepared_khsx(df_khsx)
     
     today = datetime.now().date()
     
-    # =====================================================================
-    # STEP 1: Filter for SX AMJ (Production)
-    # =====================================================================
-    vba_sx_threshold = today + timedelta(days=10)
-    
-    mask_sx_1 = df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() == ''
-    mask_sx_2 = df.iloc[:, idx_ngay_giao_phoi].astype(str).str.strip() != ''
-    
-    thoi_han_values = df.iloc[:, idx_thoi_han].astype(str).str.strip()
-    mask_sx_3 = pd.Series([False] * len(df), index=df.index)
-    
-    for idx, th_str in thoi_han_values.items():
-        if th_str and th_str != '':
-            try:
-                th_date = pd.to_datetime(th_str, format='%d/%m/%Y', errors='coerce')
-                if pd.notna(th_date):
-                    mask_sx_3.loc[idx] = th_date.date() <= vba_sx_threshold
-            except:
-                pass
-    
-    df_sx_filtered = df[mask_sx_1 & mask_sx_2 & mask_sx_3].copy()
-    
-    # Parse dates and quantities for SX
-    df_sx_filtered['So_luong'] = pd.to_numeric(
-        df_sx_filtered.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    df_sx_filtered['TH_date'] = pd.to_datetime(
-        df_sx_filtered.iloc[:, idx_thoi_han],
-        format='%d/%m/%Y',
-        errors='coerce'
-    )
-    
-    df_sx_filtered['KH'] = df_sx_filtered.iloc[:, idx_kh].astype(str).str.strip()
+    # TH mới khách hàng, So_luong and KH were parsed ONCE at load time (see add_order_flags)
+    flags = df['order_flags'].to_numpy()
+    th_dates = df['TH_date']
+    so_luong = df['So_luong_num']
+    kh = pd.Series(np.where(has_flags(flags, FLAG_RRC), 'RRC', ''), index=df.index)  # only RRC / not RRC matters
     
     # =====================================================================
-    # STEP 2: Filter for PKT AMJ (Quality Control)
+    # STEP 1 & 2: Filter for SX AMJ (Production) and PKT AMJ (Quality Control)
+    # SX: Field 41 (AO) empty, Field 17 (Q) not empty, Field 14 (TH) <= Date + 10
+    # PKT: AO not empty, AS empty, W empty, TH <= Date + 8, DISTINCT orders (ORKD)
     # =====================================================================
-    vba_pkt_threshold = today + timedelta(days=8)
-    
-    mask_pkt_1 = pd.Series([False] * len(df), index=df.index)
-    for idx, th_str in thoi_han_values.items():
-        if th_str and th_str != '':
-            try:
-                th_date = pd.to_datetime(th_str, format='%d/%m/%Y', errors='coerce')
-                if pd.notna(th_date):
-                    mask_pkt_1.loc[idx] = th_date.date() <= vba_pkt_threshold
-            except:
-                pass
-    
-    mask_pkt_2 = df.iloc[:, idx_ngay_giao_qlcl].astype(str).str.strip() != ''
-    mask_pkt_3 = df.iloc[:, idx_field_as].astype(str).str.strip() == ''
-    mask_pkt_4 = df.iloc[:, idx_field_w].astype(str).str.strip() == ''
-    
-    df_pkt_temp = df[mask_pkt_1 & mask_pkt_2 & mask_pkt_3 & mask_pkt_4].copy()
-    
-    # Get DISTINCT orders for PKT
-    df_pkt_filtered = df_pkt_temp.drop_duplicates(subset=[df_pkt_temp.columns[4]], keep='first')  # ORKD column
-    
-    # Parse dates and quantities for PKT
-    df_pkt_filtered['So_luong'] = pd.to_numeric(
-        df_pkt_filtered.iloc[:, idx_so_luong].astype(str).str.replace(',', ''),
-        errors='coerce'
-    ).fillna(0).astype(int)
-    
-    df_pkt_filtered['TH_date'] = pd.to_datetime(
-        df_pkt_filtered.iloc[:, idx_thoi_han],
-        format='%d/%m/%Y',
-        errors='coerce'
-    )
-    
-    df_pkt_filtered['KH'] = df_pkt_filtered.iloc[:, idx_kh].astype(str).str.strip()
+    sx_rows, pkt_rows = select_overdue_plan_rows(df, today)
+    sx_index = build_overdue_horizon_index(th_dates[sx_rows], so_luong[sx_rows], kh[sx_rows])
+    pkt_index = build_overdue_horizon_index(th_dates[pkt_rows], so_luong[pkt_rows], kh[pkt_rows])
     
     # =====================================================================
     # STEP 3: Calculate ALL metrics with SUMIF logic
+    # Each SUMIF is a searchsorted lookup on the sorted prefix sums:
+    #   Overdue  = SUMIF(TH <= threshold)
+    #   Due Soon = SUMIF(TH > threshold) = total - Overdue
     # =====================================================================
     sx_threshold = today + timedelta(days=5)  # SX uses TODAY+5 (PREDICTED)
     pkt_threshold = today + timedelta(days=3)  # PKT uses TODAY+3 (PREDICTED)
@@ -150,70 +231,16 @@ def calculate_all_overdue_metrics(
     results = {}
     
     # --- SX AMJ Metrics (PREDICTED - for Section 3) ---
-    # RRC Overdue
-    sx_rrc_overdue_df = df_sx_filtered[
-        (df_sx_filtered['KH'] == 'RRC') &
-        df_sx_filtered['TH_date'].notna() &
-        (df_sx_filtered['TH_date'].dt.date <= sx_threshold)
-    ]
-    results['sx_rrc_overdue'] = int(sx_rrc_overdue_df['So_luong'].sum())
-    
-    # RRC Due Soon
-    sx_rrc_due_soon_df = df_sx_filtered[
-        (df_sx_filtered['KH'] == 'RRC') &
-        df_sx_filtered['TH_date'].notna() &
-        (df_sx_filtered['TH_date'].dt.date > sx_threshold)
-    ]
-    results['sx_rrc_due_soon'] = int(sx_rrc_due_soon_df['So_luong'].sum())
-    
-    # External Overdue
-    sx_ext_overdue_df = df_sx_filtered[
-        (df_sx_filtered['KH'] != 'RRC') &
-        df_sx_filtered['TH_date'].notna() &
-        (df_sx_filtered['TH_date'].dt.date <= sx_threshold)
-    ]
-    results['sx_ext_overdue'] = int(sx_ext_overdue_df['So_luong'].sum())
-    
-    # External Due Soon
-    sx_ext_due_soon_df = df_sx_filtered[
-        (df_sx_filtered['KH'] != 'RRC') &
-        df_sx_filtered['TH_date'].notna() &
-        (df_sx_filtered['TH_date'].dt.date > sx_threshold)
-    ]
-    results['sx_ext_due_soon'] = int(sx_ext_due_soon_df['So_luong'].sum())
+    for segment, prefix in [(SEGMENT_RRC, 'sx_rrc'), (SEGMENT_EXTERNAL, 'sx_ext')]:
+        overdue = quantity_due_by(sx_index, segment, sx_threshold)
+        results[f'{prefix}_overdue'] = overdue
+        results[f'{prefix}_due_soon'] = total_quantity(sx_index, segment) - overdue
     
     # --- PKT AMJ Metrics (PREDICTED - for Section 3) ---
-    # RRC Overdue
-    pkt_rrc_overdue_df = df_pkt_filtered[
-        (df_pkt_filtered['KH'] == 'RRC') &
-        df_pkt_filtered['TH_date'].notna() &
-        (df_pkt_filtered['TH_date'].dt.date <= pkt_threshold)
-    ]
-    results['pkt_rrc_overdue'] = int(pkt_rrc_overdue_df['So_luong'].sum())
-    
-    # RRC Due Soon
-    pkt_rrc_due_soon_df = df_pkt_filtered[
-        (df_pkt_filtered['KH'] == 'RRC') &
-        df_pkt_filtered['TH_date'].notna() &
-        (df_pkt_filtered['TH_date'].dt.date > pkt_threshold)
-    ]
-    results['pkt_rrc_due_soon'] = int(pkt_rrc_due_soon_df['So_luong'].sum())
-    
-    # External Overdue
-    pkt_ext_overdue_df = df_pkt_filtered[
-        (df_pkt_filtered['KH'] != 'RRC') &
-        df_pkt_filtered['TH_date'].notna() &
-        (df_pkt_filtered['TH_date'].dt.date <= pkt_threshold)
-    ]
-    results['pkt_ext_overdue'] = int(pkt_ext_overdue_df['So_luong'].sum())
-    
-    # External Due Soon
-    pkt_ext_due_soon_df = df_pkt_filtered[
-        (df_pkt_filtered['KH'] != 'RRC') &
-        df_pkt_filtered['TH_date'].notna() &
-        (df_pkt_filtered['TH_date'].dt.date > pkt_threshold)
-    ]
-    results['pkt_ext_due_soon'] = int(pkt_ext_due_soon_df['So_luong'].sum())
+    for segment, prefix in [(SEGMENT_RRC, 'pkt_rrc'), (SEGMENT_EXTERNAL, 'pkt_ext')]:
+        overdue = quantity_due_by(pkt_index, segment, pkt_threshold)
+        results[f'{prefix}_overdue'] = overdue
+        results[f'{prefix}_due_soon'] = total_quantity(pkt_index, segment) - overdue
     
     # =====================================================================
     # STEP 4: Calculate ACTUAL overdue (for Section 4)
@@ -222,12 +249,7 @@ def calculate_all_overdue_metrics(
     
     # --- SX AMJ ACTUAL Overdue (RRC only) ---
     # Excel: =SUMIF('Hàng quá hạn và tới hạn SX AMJ'!$H$7:$H$21;"<="&TODAY();'Hàng quá hạn và tới hạn SX AMJ'!$F$7:$F$21)
-    sx_rrc_actual_overdue_df = df_sx_filtered[
-        (df_sx_filtered['KH'] == 'RRC') &
-        df_sx_filtered['TH_date'].notna() &
-        (df_sx_filtered['TH_date'].dt.date <= today)  # TODAY, no offset!
-    ]
-    results['sx_rrc_actual_overdue'] = int(sx_rrc_actual_overdue_df['So_luong'].sum())
+    results['sx_rrc_actual_overdue'] = quantity_due_by(sx_index, SEGMENT_RRC, today)  # TODAY, no offset!
     
     # Calculate actual due soon = total - actual overdue
     rrc_total = results['sx_rrc_overdue'] + results['sx_rrc_due_soon']
@@ -235,17 +257,26 @@ def calculate_all_overdue_metrics(
     
     # --- PKT AMJ ACTUAL Overdue (RRC only) ---
     # Excel: =SUMIF('Hàng quá hạn và tới hạn PKT AMJ'!$H$7:$H$1048576;"<="&TODAY();'Hàng quá hạn và tới hạn PKT AMJ'!$F$7:$F$1048576)
-    pkt_rrc_actual_overdue_df = df_pkt_filtered[
-        (df_pkt_filtered['KH'] == 'RRC') &
-        df_pkt_filtered['TH_date'].notna() &
-        (df_pkt_filtered['TH_date'].dt.date <= today)  # TODAY, no offset!
-    ]
-    results['pkt_rrc_actual_overdue'] = int(pkt_rrc_actual_overdue_df['So_luong'].sum())
+    results['pkt_rrc_actual_overdue'] = quantity_due_by(pkt_index, SEGMENT_RRC, today)  # TODAY, no offset!
     
     # Calculate actual due soon = total - actual overdue
     pkt_rrc_total = results['pkt_rrc_overdue'] + results['pkt_rrc_due_soon']
     results['pkt_rrc_actual_due_soon'] = pkt_rrc_total - results['pkt_rrc_actual_overdue']
     
+    # =====================================================================
+    # STEP 5 (optional): "Quantity due within N days" curves, N = 0..horizon_days
+    # Built on the plan WITHOUT the VBA Date+10 / Date+8 cut-off, so the
+    # curve keeps growing past the VBA horizon
+    # =====================================================================
+    if horizon_days is not None:
+        sx_all_rows = df.index[has_flags(flags, *SX_OVERDUE_PLAN)]
+        sx_all_index = build_overdue_horizon_index(th_dates[sx_all_rows], so_luong[sx_all_rows], kh[sx_all_rows])
+        results['sx_horizon_curve'] = overdue_horizon_curve(sx_all_index, today, horizon_days)
+        
+        pkt_all_rows = _distinct_orders(df, has_flags(flags, PKT_INVENTORY[0] | FLAG_TH_DATE))
+        pkt_all_index = build_overdue_horizon_index(th_dates[pkt_all_rows], so_luong[pkt_all_rows], kh[pkt_all_rows])
+        results['pkt_horizon_curve'] = overdue_horizon_curve(pkt_all_index, today, horizon_days)
+    
     return results
 
 
@@ -68,16 +68,8 @@ def get_vba_filtered_orders(
     
     # FILTER 3: Field 14 (TH mới khách hàng) <= Date + 10
     thoi_han_values = df.iloc[:, idx_thoi_han].astype(str).str.strip()
-    mask3 = pd.Series([False] * len(df), index=df.index)
-    
-    for idx, th_str in thoi_han_values.items():
-        if th_str and th_str != '':
-            try:
-                th_date = pd.to_datetime(th_str, format='%d/%m/%Y', errors='coerce')
-                if pd.notna(th_date):
-                    mask3.loc[idx] = th_date.date() <= vba_date_threshold
-            except:
-                pass
+    th_dates = pd.to_datetime(thoi_han_values, format='%d/%m/%Y', errors='coerce')
+    mask3 = th_dates <= pd.Timestamp(vba_date_threshold)  # NaT compares as False
     
     # Combine all 3 VBA filters
     mask_all = mask1 & mask2 & mask3
@@ -96,12 +88,8 @@ def get_vba_filtered_orders(
         errors='coerce'
     ).fillna(0).astype(int)
     
-    # Parse TH_moi_khach_hang dates
-    result_df['TH_date'] = pd.to_datetime(
-        result_df['TH_moi_khach_hang'],
-        format='%d/%m/%Y',
-        errors='coerce'
-    )
+    # TH_moi_khach_hang dates (already parsed for FILTER 3)
+    result_df['TH_date'] = th_dates[mask_all]
     
     return result_df
 
@@ -152,7 +140,7 @@ def calculate_overdue_orders(
     
     df_overdue = df_customer[
         df_customer['TH_date'].notna() & 
-        (df_customer['TH_date'].dt.date <= threshold)
+        (df_customer['TH_date'] <= pd.Timestamp(threshold))
     ].copy()
     
     total_overdue = df_overdue['So_luong'].sum()
@@ -211,7 +199,7 @@ def calculate_due_soon_orders(
     
     df_due_soon = df_customer[
         df_customer['TH_date'].notna() & 
-        (df_customer['TH_date'].dt.date > threshold)
+        (df_customer['TH_date'] > pd.Timestamp(threshold))
     ].copy()
     
     total_due_soon = df_due_soon['So_luong'].sum()
@@ -67,16 +67,8 @@ def get_pkt_vba_filtered_orders(
     
     # FILTER 1: Field 14 (TH mới khách hàng) <= Date + 8
     thoi_han_values = df.iloc[:, idx_thoi_han].astype(str).str.strip()
-    mask1 = pd.Series([False] * len(df), index=df.index)
-    
-    for idx, th_str in thoi_han_values.items():
-        if th_str and th_str != '':
-            try:
-                th_date = pd.to_datetime(th_str, format='%d/%m/%Y', errors='coerce')
-                if pd.notna(th_date):
-                    mask1.loc[idx] = th_date.date() <= vba_date_threshold
-            except:
-                pass
+    th_dates = pd.to_datetime(thoi_han_values, format='%d/%m/%Y', errors='coerce')
+    mask1 = th_dates <= pd.Timestamp(vba_date_threshold)  # NaT compares as False
     
     print(f"[PKT] Filter 1 - Field 14 (TH moi khach hang) <= {vba_date_threshold.strftime('%d/%m/%Y')}: {mask1.sum()} rows")
     
@@ -118,12 +110,8 @@ def get_pkt_vba_filtered_orders(
         errors='coerce'
     ).fillna(0).astype(int)
     
-    # Parse TH_moi_khach_hang dates
-    result_df['TH_date'] = pd.to_datetime(
-        result_df['TH_moi_khach_hang'],
-        format='%d/%m/%Y',
-        errors='coerce'
-    )
+    # TH_moi_khach_hang dates (already parsed for FILTER 1)
+    result_df['TH_date'] = th_dates[filtered_df_distinct.index].values
     
     return result_df
 
@@ -178,7 +166,7 @@ def calculate_pkt_overdue_orders(
     
     df_overdue = df_customer[
         df_customer['TH_date'].notna() & 
-        (df_customer['TH_date'].dt.date <= threshold)
+        (df_customer['TH_date'] <= pd.Timestamp(threshold))
     ].copy()
     
     total_overdue = df_overdue['So_luong'].sum()
@@ -243,7 +231,7 @@ def calculate_pkt_due_soon_orders(
     
     df_due_soon = df_customer[
         df_customer['TH_date'].notna() & 
-        (df_customer['TH_date'].dt.date > threshold)
+        (df_customer['TH_date'] > pd.Timestamp(threshold))
     ].copy()
     
     total_due_soon = df_due_soon['So_luong'].sum()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Daily KPI Store
+Materialized per-day KPIs keyed by (date, department), persisted to a CSV file
+and updated incrementally.
+
+Every stored row keeps a fingerprint of the sheet rows it was computed from.
+A refresh only recomputes:
+- days whose fingerprint changed (rows added / edited / deleted in the sheets)
+- days that are not stored yet
+- today (the sheets are still being filled in), once per data version
+Days whose source rows disappeared are dropped. Monthly averages and trend charts
+then read the stored rows instead of recomputing every day.
+
+A store remembers the data version (all day fingerprints) it was last refreshed
+with, and the loaded file is kept in memory until it changes on disk, so a rerun
+on unchanged sheets neither recomputes, re-reads nor rewrites anything.
+"""
+
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+from production_capacity_helper import calculate_production_capacity_range
+from qc_capacity_helper import calculate_quality_control_capacity_range
+
+
+DEPARTMENT_SX = 'SX'  # Sản xuất AMJ (PHTCV + GCKT_GPKT)
+DEPARTMENT_QC = 'QC'  # Kiểm tra (giao_kho_vp + HR head counts)
+
+# KPI columns (máy 12h / 8h / dừng are only defined for SX)
+KPI_COLUMNS = ['san_luong', 'cs_tong', 'cs_truc_tiep', 'may_12h', 'may_8h', 'may_dung']
+KPI_STORE_COLUMNS = ['date', 'department'] + KPI_COLUMNS + ['source_hash', 'computed_at']
+
+DEFAULT_KPI_STORE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'kpi_store', 'daily_kpis.csv'
+)
+
+_store_lock = threading.Lock()  # Streamlit sessions share the process
+
+# path -> ((mtime_ns, size), store) of the last loaded / saved file
+_loaded_stores = {}
+
+# store.attrs key: {department: (data version, day)} of the last refresh
+REFRESHED_VERSIONS_ATTR = 'refreshed_versions'
+
+
+def get_kpi_store_path() -> str:
+    """Store file path (env DAILY_KPI_STORE_PATH overrides the default)"""
+    return os.environ.get('DAILY_KPI_STORE_PATH', DEFAULT_KPI_STORE_PATH)
+
+
+def empty_kpi_store() -> pd.DataFrame:
+    store = pd.DataFrame(columns=KPI_STORE_COLUMNS)
+    store['date'] = pd.to_datetime(store['date'])
+    return store
+
+
+def _file_stamp(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_kpi_store(path: str = None) -> pd.DataFrame:
+    """
+    Load the store (an empty store if the file is missing, unreadable or from
+    an older column layout - it is then rebuilt by the next refresh)
+
+    The file is only parsed again when it changed on disk; the returned frame
+    is shared between callers and must not be modified in place.
+    """
+    path = path or get_kpi_store_path()
+    if not os.path.exists(path):
+        return empty_kpi_store()
+    try:
+        stamp = _file_stamp(path)
+        cached = _loaded_stores.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        store = pd.read_csv(path, dtype={'department': str, 'source_hash': str, 'computed_at': str})
+    except (OSError, ValueError, pd.errors.ParserError):
+        return empty_kpi_store()
+    if list(store.columns) != KPI_STORE_COLUMNS:
+        return empty_kpi_store()
+    store['date'] = pd.to_datetime(store['date'], format='%Y-%m-%d', errors='coerce')
+    store = store[store['date'].notna()].reset_index(drop=True)
+    _loaded_stores[path] = (stamp, store)
+    return store
+
+
+def save_kpi_store(store: pd.DataFrame, path: str = None):
+    """Write the store atomically (temp file + rename)"""
+    path = path or get_kpi_store_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with _store_lock:
+        store.to_csv(tmp_path, index=False, date_format='%Y-%m-%d')
+        os.replace(tmp_path, path)
+        # The next load returns this frame (and its refreshed versions) without parsing the file
+        _loaded_stores[path] = (_file_stamp(path), store)
+
+
+# =====================================================================
+# Fingerprints
+# =====================================================================
+
+def hash_rows_by_day(df: pd.DataFrame, dates) -> pd.Series:
+    """
+    Fingerprint of the rows of every day
+
+    Args:
+        df: Source rows
+        dates: Datetime values aligned with df (rows with NaT are ignored)
+
+    Returns:
+        uint64 Series indexed by day: wrapping sum of the row hashes of that day,
+        so any added / edited / deleted row changes it (row order does not)
+    """
+    if df is None or len(df) == 0:
+        return pd.Series(dtype=np.uint64)
+
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+    days = pd.DatetimeIndex(dates).normalize()
+    valid = ~days.isna()
+
+    codes, unique_days = pd.factorize(days[valid])
+    sums = np.zeros(len(unique_days), dtype=np.uint64)
+    np.add.at(sums, codes, row_hashes[valid])
+    return pd.Series(sums, index=pd.DatetimeIndex(unique_days)).sort_index()
+
+
+def hash_frame(df: pd.DataFrame) -> int:
+    """Fingerprint of a whole (non date-keyed) frame, 0 if missing / empty"""
+    if df is None or len(df) == 0:
+        return 0
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy(dtype=np.uint64)
+    return int(row_hashes.sum(dtype=np.uint64) + np.uint64(len(df)))
+
+
+def build_day_fingerprints(required: list, optional: list = (), global_hash: int = 0) -> pd.Series:
+    """
+    Combine per-source day hashes into one fingerprint per day
+
+    Args:
+        required: hash_rows_by_day results; a day exists only if ALL of them have it
+        optional: hash_rows_by_day results that only feed the fingerprint
+        global_hash: hash_frame of the inputs shared by every day (master tables)
+
+    Returns:
+        Series of 16-char hex strings indexed by day
+    """
+    days = required[0].index
+    for day_hashes in required[1:]:
+        days = days.intersection(day_hashes.index)
+    if len(days) == 0:
+        return pd.Series(dtype=str)
+
+    parts = pd.DataFrame(
+        {i: day_hashes.reindex(days, fill_value=0).astype(np.uint64).to_numpy()
+         for i, day_hashes in enumerate(list(required) + list(optional))},
+        index=days
+    )
+    parts['global'] = np.uint64(global_hash % (1 << 64))
+    combined = pd.util.hash_pandas_object(parts, index=True).to_numpy(dtype=np.uint64)
+    return pd.Series([f"{value:016x}" for value in combined], index=days)
+
+
+def data_version(fingerprints: pd.Series) -> str:
+    """Fingerprint of a whole data version (every day and its fingerprint)"""
+    if fingerprints.empty:
+        return '0' * 16
+    row_hashes = pd.util.hash_pandas_object(fingerprints, index=True).to_numpy(dtype=np.uint64)
+    combined = row_hashes.sum(dtype=np.uint64) + np.uint64(len(fingerprints))
+    return f"{int(combined):016x}"
+
+
+def changed_days(previous: pd.Series, current: pd.Series) -> pd.DatetimeIndex:
+    """
+    Days whose source rows changed between two data versions
+
+    Args:
+        previous, current: build_day_fingerprints results
+
+    Returns:
+        Sorted days that were added, removed or edited
+    """
+    days = previous.index.union(current.index)
+    changed = previous.reindex(days).ne(current.reindex(days)).to_numpy()
+    return days[changed]
+
+
+# =====================================================================
+# Incremental refresh
+# =====================================================================
+
+def stored_fingerprints(store: pd.DataFrame, department: str) -> pd.Series:
+    """source_hash of the stored days of one department, indexed by day"""
+    rows = store[store['department'] == department]
+    stored = pd.Series(rows['source_hash'].to_numpy(), index=pd.DatetimeIndex(rows['date']))
+    return stored[~stored.index.duplicated(keep='last')]
+
+
+def find_stale_days(store: pd.DataFrame, department: str, fingerprints: pd.Series, today=None) -> pd.DatetimeIndex:
+    """Days of `fingerprints` that are missing, changed, or today"""
+    today = pd.Timestamp(today if today is not None else datetime.now()).normalize()
+    stale = changed_days(stored_fingerprints(store, department), fingerprints)
+    stale = stale[stale.isin(fingerprints.index)]
+    if today in fingerprints.index and today not in stale:
+        stale = stale.append(pd.DatetimeIndex([today])).sort_values()
+    return stale
+
+
+def refresh_daily_kpis(store: pd.DataFrame, department: str, fingerprints: pd.Series, compute, today=None):
+    """
+    Recompute the stale days of one department and merge them into the store
+
+    Args:
+        store: Current store
+        department: DEPARTMENT_SX / DEPARTMENT_QC
+        fingerprints: build_day_fingerprints result (every day that should be stored)
+        compute: callable(stale_days: DatetimeIndex) -> DataFrame with 'date' + KPI columns
+        today: Override of the current date (tests / batch runs)
+
+    Returns:
+        (new store, DatetimeIndex of recomputed days); the same store object
+        when it was already refreshed with this data version today
+    """
+    today = pd.Timestamp(today if today is not None else datetime.now()).normalize()
+    refreshed = (data_version(fingerprints), today.strftime('%Y-%m-%d'))
+    if store.attrs.get(REFRESHED_VERSIONS_ATTR, {}).get(department) == refreshed:
+        return store, pd.DatetimeIndex([])
+
+    stale_days = find_stale_days(store, department, fingerprints, today)
+    in_department = store['department'] == department
+    removed = in_department & ~store['date'].isin(fingerprints.index)
+
+    refreshed_versions = dict(store.attrs.get(REFRESHED_VERSIONS_ATTR, {}))
+    refreshed_versions[department] = refreshed
+
+    if len(stale_days) == 0 and not removed.any():
+        store = store.copy(deep=False)
+        store.attrs[REFRESHED_VERSIONS_ATTR] = refreshed_versions
+        return store, stale_days
+
+    new_rows = empty_kpi_store()
+    if len(stale_days) > 0:
+        kpis = compute(stale_days)
+        if kpis is not None and not kpis.empty:
+            kpis = kpis[kpis['date'].isin(stale_days)]
+            new_rows = kpis.reindex(columns=KPI_STORE_COLUMNS)
+            new_rows['department'] = department
+            new_rows['source_hash'] = fingerprints.reindex(kpis['date']).to_numpy()
+            new_rows['computed_at'] = datetime.now().isoformat(timespec='seconds')
+
+    kept = store[~(removed | (in_department & store['date'].isin(stale_days)))]
+    frames = [frame for frame in (kept, new_rows) if not frame.empty]
+    if frames:
+        updated = pd.concat(frames, ignore_index=True)
+        updated = updated.sort_values(['department', 'date'], kind='stable').reset_index(drop=True)
+        updated = updated[KPI_STORE_COLUMNS]
+    else:
+        updated = empty_kpi_store()
+    updated.attrs = {REFRESHED_VERSIONS_ATTR: refreshed_versions}
+    return updated, stale_days
+
+
+def refresh_production_kpis(store, df_phtcv, df_gckt, gckt_times, df_machine_list, today=None):
+    """
+    Refresh Sản xuất AMJ days (days having both PHTCV rows and GCKT deliveries)
+
+    The fingerprint of a day covers its PHTCV rows, its GCKT processing times
+    (so PKY changes only touch the days delivering the changed parts) and the
+    machine list.
+    """
+    if (df_phtcv is None or df_phtcv.empty or 'date_parsed' not in df_phtcv.columns
+            or gckt_times is None or 'ngay_giao_parsed' not in df_gckt.columns):
+        return store, pd.DatetimeIndex([])
+
+    phtcv_days = df_phtcv['date_parsed'].dt.normalize()
+    gckt_days = df_gckt['ngay_giao_parsed'].dt.normalize()
+
+    fingerprints = build_day_fingerprints(
+        required=[
+            hash_rows_by_day(df_phtcv, phtcv_days),
+            hash_rows_by_day(gckt_times, gckt_days),
+        ],
+        global_hash=hash_frame(df_machine_list)
+    )
+
+    def compute(stale_days):
+        stale_rows = df_phtcv[phtcv_days.isin(stale_days).to_numpy()]
+        return calculate_production_capacity_range(
+            stale_rows, df_gckt, gckt_times, df_machine_list,
+            stale_days.min(), stale_days.max()
+        )
+
+    return refresh_daily_kpis(store, DEPARTMENT_SX, fingerprints, compute, today)
+
+
+def refresh_qc_kpis(store, df_giao_kho_vp, df_shift_schedule, df_hr_daily_head_counts,
+                    df_thoi_gian_hoan_thanh, today=None):
+    """
+    Refresh Kiểm tra days (days having giao_kho_vp deliveries)
+
+    The fingerprint of a day covers its deliveries and its HR head counts;
+    the standard time table (and whether a shift schedule exists) is global.
+    """
+    if (df_giao_kho_vp is None or df_giao_kho_vp.empty
+            or 'ngay_dong_goi_parsed' not in df_giao_kho_vp.columns):
+        return store, pd.DatetimeIndex([])
+
+    delivery_days = df_giao_kho_vp['ngay_dong_goi_parsed'].dt.normalize()
+
+    optional = []
+    if (df_hr_daily_head_counts is not None and not df_hr_daily_head_counts.empty
+            and 'Working Date' in df_hr_daily_head_counts.index.names):
+        optional.append(hash_rows_by_day(
+            df_hr_daily_head_counts.reset_index(),
+            df_hr_daily_head_counts.index.get_level_values('Working Date')
+        ))
+
+    has_shift_schedule = int(df_shift_schedule is not None and not df_shift_schedule.empty)
+    fingerprints = build_day_fingerprints(
+        required=[hash_rows_by_day(df_giao_kho_vp, delivery_days)],
+        optional=optional,
+        global_hash=hash_frame(df_thoi_gian_hoan_thanh) + has_shift_schedule
+    )
+
+    def compute(stale_days):
+        stale_rows = df_giao_kho_vp[delivery_days.isin(stale_days).to_numpy()]
+        return calculate_quality_control_capacity_range(
+            stale_rows, df_shift_schedule, df_hr_daily_head_counts, df_thoi_gian_hoan_thanh,
+            stale_days.min(), stale_days.max()
+        )
+
+    return refresh_daily_kpis(store, DEPARTMENT_QC, fingerprints, compute, today)
+
+
+def read_daily_kpis(store: pd.DataFrame, department: str, start_date, end_date) -> pd.DataFrame:
+    """Stored KPI rows of one department for start_date <= date <= end_date, by date"""
+    start_day = pd.Timestamp(start_date).normalize()
+    end_day = pd.Timestamp(end_date).normalize()
+    rows = store[
+        (store['department'] == department) &
+        (store['date'] >= start_day) & (store['date'] <= end_day)
+    ]
+    return rows.sort_values('date').reset_index(drop=True)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Shared Date Parsing Utility
+Sheet date columns (ngay_giao, ngày tháng, ngay_dong_goi, Work Date, Working Date,
+KHSX Q / N...) hold a few hundred distinct strings repeated over tens of thousands
+of rows. parse_dates() parses each DISTINCT string only once and maps the result
+back to every row.
+
+Parsed values are memoized per (format, string) at module level, so the memo is
+shared by every sheet and survives Streamlit reruns (same process).
+"""
+
+import threading
+
+import pandas as pd
+import numpy as np
+
+
+# Memo size bound (distinct (format, string) pairs); cleared when exceeded
+DATE_MEMO_MAX_SIZE = 200_000
+
+_date_memo = {}  # {(format, value): numpy datetime64[ns]}
+_date_memo_lock = threading.Lock()  # Sheets are loaded from a thread pool
+
+
+def parse_dates(values, format: str = '%d/%m/%Y') -> pd.Series:
+    """
+    Vectorized equivalent of pd.to_datetime(values, format=format, errors='coerce')
+    that only parses the unique values
+
+    Args:
+        values: Series (or array-like) of date strings
+        format: strptime format of the strings
+
+    Returns:
+        datetime64[ns] Series aligned with `values` (NaT for empty / invalid values)
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values)
+
+    codes, uniques = pd.factorize(values)  # missing values get code -1
+    uniques = list(uniques)
+
+    with _date_memo_lock:
+        known = {value: _date_memo[(format, value)] for value in uniques if (format, value) in _date_memo}
+    missing = [value for value in uniques if value not in known]
+
+    if missing:
+        parsed = pd.to_datetime(
+            pd.Series(missing, dtype=object), format=format, errors='coerce'
+        ).to_numpy(dtype='datetime64[ns]')
+        known.update(zip(missing, parsed))
+        with _date_memo_lock:
+            if len(_date_memo) + len(missing) > DATE_MEMO_MAX_SIZE:
+                _date_memo.clear()
+            _date_memo.update({(format, value): date for value, date in zip(missing, parsed)})
+
+    unique_dates = np.array([known[value] for value in uniques], dtype='datetime64[ns]')
+
+    # Append NaT so code -1 (missing) maps to it
+    unique_dates = np.append(unique_dates, np.datetime64('NaT', 'ns'))
+    return pd.Series(unique_dates[codes], index=values.index, name=values.name)
+
+
+def clear_date_memo():
+    """Drop all memoized parsed dates"""
+    with _date_memo_lock:
+        _date_memo.clear()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Day-partitioned index for date-keyed sheets (GCKT_GPKT, PHTCV, giao_kho_vp)
+
+The frame is kept sorted by date (stable, rows without a valid date at the end)
+with the start offset of every day, so a single day, a month or any date range
+is a positional slice (frame.iloc[start:stop]) instead of a full-column scan +
+.copy() per day.
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def sort_by_day(df: pd.DataFrame, date_column: str) -> pd.DataFrame:
+    """
+    Stable-sort a frame by the day of date_column (NaT rows last)
+
+    Used by the sheet loaders so the cached frame is already in day order
+    and build_day_index does not need to reorder it.
+    """
+    days = df[date_column].dt.normalize().to_numpy(dtype='datetime64[ns]')
+    order = np.argsort(days, kind='stable')  # numpy sorts NaT last
+    if np.array_equal(order, np.arange(len(order))):
+        return df
+    return df.iloc[order]
+
+
+def build_day_index(df: pd.DataFrame, date_column: str) -> dict:
+    """
+    Build the day index of a date-keyed sheet
+
+    Args:
+        df: DataFrame with a parsed datetime column
+        date_column: Name of the parsed date column (e.g. 'ngay_giao_parsed')
+
+    Returns:
+        dict with:
+        - 'frame': df sorted by day (df itself if already sorted)
+        - 'days': sorted DatetimeIndex of the distinct days
+        - 'offsets': int64 array, rows of days[i] are frame.iloc[offsets[i]:offsets[i + 1]]
+        - 'date_column': date_column
+    """
+    frame = sort_by_day(df, date_column)
+    days = frame[date_column].dt.normalize().to_numpy(dtype='datetime64[ns]')
+    valid_days = days[~np.isnat(days)]  # NaT rows are at the end
+
+    unique_days, counts = np.unique(valid_days, return_counts=True)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    return {
+        'frame': frame,
+        'days': pd.DatetimeIndex(unique_days),
+        'offsets': offsets,
+        'date_column': date_column,
+    }
+
+
+def range_slice(day_index: dict, start_date, end_date) -> pd.DataFrame:
+    """Rows with start_date <= day <= end_date (both inclusive, compared by day)"""
+    days = day_index['days']
+    start = days.searchsorted(pd.Timestamp(start_date).normalize(), side='left')
+    stop = days.searchsorted(pd.Timestamp(end_date).normalize(), side='right')
+    return day_index['frame'].iloc[day_index['offsets'][start]:day_index['offsets'][stop]]
+
+
+def day_slice(day_index: dict, date) -> pd.DataFrame:
+    """Rows of one day"""
+    return range_slice(day_index, date, date)
+
+
+def month_slice(day_index: dict, month) -> pd.DataFrame:
+    """Rows of one month (pd.Period or 'YYYY-MM')"""
+    period = pd.Period(month, freq='M')
+    return range_slice(day_index, period.start_time, period.end_time)
+
+
+def available_months(day_index: dict) -> list:
+    """Distinct months (pd.Period), newest first"""
+    return sorted(day_index['days'].to_period('M').unique(), reverse=True)
+
+
+def available_days(day_index: dict, month=None) -> list:
+    """Distinct days (datetime.date), newest first, optionally within one month"""
+    days = day_index['days']
+    if month is not None:
+        period = pd.Period(month, freq='M')
+        days = days[(days >= period.start_time) & (days <= period.end_time)]
+    return [day.date() for day in days[::-1]]
+
+
+def day_groups(day_index: dict, start_date, end_date):
+    """
+    Iterate (day, rows) for every day with data in [start_date, end_date]
+
+    Yields:
+        (pd.Timestamp, DataFrame slice)
+    """
+    days = day_index['days']
+    offsets = day_index['offsets']
+    start = days.searchsorted(pd.Timestamp(start_date).normalize(), side='left')
+    stop = days.searchsorted(pd.Timestamp(end_date).normalize(), side='right')
+    for position in range(start, stop):
+        yield days[position], day_index['frame'].iloc[offsets[position]:offsets[position + 1]]
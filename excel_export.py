@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Excel Export
+Streams DataFrames to .xlsx in constant memory (xlsxwriter)
+"""
+
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+
+EXCEL_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+DATE_FORMAT = 'dd/mm/yyyy'
+
+
+def _cell_writer(worksheet, series: pd.Series, cell_format=None, date_format=None):
+    """
+    Typed write function (row, col, value) for one column
+
+    Datetime columns become Excel dates, numbers stay numbers, NaN / NaT / None
+    are left blank and everything else is written as text.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        def write(row, col, value):
+            if not pd.isna(value):
+                worksheet.write_datetime(row, col, value.to_pydatetime().replace(tzinfo=None), date_format)
+    elif pd.api.types.is_bool_dtype(series):
+        def write(row, col, value):
+            if not pd.isna(value):
+                worksheet.write_boolean(row, col, bool(value), cell_format)
+    elif pd.api.types.is_numeric_dtype(series):
+        def write(row, col, value):
+            if not pd.isna(value):
+                worksheet.write_number(row, col, float(value), cell_format)
+    else:
+        def write(row, col, value):
+            if value is None or (not isinstance(value, str) and pd.isna(value)):
+                return
+            if isinstance(value, datetime):
+                worksheet.write_datetime(row, col, value.replace(tzinfo=None), date_format)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                worksheet.write_number(row, col, value, cell_format)
+            else:
+                worksheet.write_string(row, col, str(value), cell_format)
+    return write
+
+
+def write_excel(sheets: dict, output, column_formats: dict = None):
+    """
+    Write DataFrames to one workbook, row by row (xlsxwriter constant_memory)
+
+    Args:
+        sheets: {sheet name: DataFrame}, in worksheet order (index is not written)
+        output: File path or binary stream (e.g. BytesIO)
+        column_formats: Optional {column name: Excel num_format}, e.g. {'CS tổng (%)': '0.0'}
+    """
+    import xlsxwriter
+
+    column_formats = column_formats or {}
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    try:
+        header_format = workbook.add_format({'bold': True})
+        date_format = workbook.add_format({'num_format': DATE_FORMAT})
+        num_formats = {
+            num_format: workbook.add_format({'num_format': num_format})
+            for num_format in set(column_formats.values())
+        }
+
+        for sheet_name, df in sheets.items():
+            worksheet = workbook.add_worksheet(sheet_name)
+            columns = list(df.columns)
+            writers = []
+            for col, column in enumerate(columns):
+                cell_format = num_formats.get(column_formats.get(column))
+                worksheet.set_column(col, col, max(12, len(str(column)) + 2))
+                writers.append(_cell_writer(worksheet, df[column], cell_format, date_format))
+
+            # constant_memory: a row is flushed once the next one starts, so write strictly in row order
+            worksheet.write_row(0, 0, [str(column) for column in columns], header_format)
+            for row, values in enumerate(df.itertuples(index=False, name=None), start=1):
+                for col, value in enumerate(values):
+                    writers[col](row, col, value)
+    finally:
+        workbook.close()
+
+
+def excel_bytes(sheets: dict, column_formats: dict = None) -> bytes:
+    """write_excel into memory, returns the .xlsx content"""
+    output = BytesIO()
+    write_excel(sheets, output, column_formats=column_formats)
+    return output.getvalue()
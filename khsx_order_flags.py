@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+KHSX Order Status Flags
+Packs the row predicates shared by every inventory / overdue metric into ONE
+uint8 bitfield column ('order_flags'), computed once per data load.
+
+Every metric is then an integer mask comparison:
+    has_flags(df['order_flags'], required=FLAG_AO_FILLED | FLAG_AS_EMPTY | FLAG_W_EMPTY)
+"""
+
+import pandas as pd
+import numpy as np
+
+from date_parsing import parse_dates
+
+
+# KHSX column indices (iloc)
+KHSX_IDX_ORKD = 4             # E (col 5): ORKD
+KHSX_IDX_SO_LUONG = 10        # K (col 11): Số lượng ĐH
+KHSX_IDX_KH = 11              # L (col 12): KH
+KHSX_IDX_THOI_HAN = 13        # N (col 14): TH mới khách hàng
+KHSX_IDX_NGAY_GIAO_PHOI = 16  # Q (col 17): Ngày giao phôi sx AMJ
+KHSX_IDX_FIELD_W = 22         # W (col 23): Field W
+KHSX_IDX_NGAY_GIAO_QLCL = 40  # AO (col 41): Ngày giao QLCL
+KHSX_IDX_FIELD_AS = 44        # AS (col 45): Field AS
+
+# Bit flags (uint8)
+FLAG_RRC = 1 << 0        # L = 'RRC'
+FLAG_Q_FILLED = 1 << 1   # Q <> empty (VBA filter)
+FLAG_Q_DATE = 1 << 2     # Q is a valid date (ISNUMBER)
+FLAG_AO_FILLED = 1 << 3  # AO <> empty (đã giao QLCL)
+FLAG_AS_EMPTY = 1 << 4   # AS = empty
+FLAG_W_EMPTY = 1 << 5    # W = empty
+FLAG_TH_DATE = 1 << 6    # TH mới khách hàng is a valid date
+
+# Common predicates as (required, forbidden) flag pairs
+SX_INVENTORY = (FLAG_Q_DATE, FLAG_AO_FILLED)                       # Sản xuất: Q date, AO empty
+SX_OVERDUE_PLAN = (FLAG_Q_FILLED, FLAG_AO_FILLED)                  # VBA SX: Q not empty, AO empty
+PKT_INVENTORY = (FLAG_AO_FILLED | FLAG_AS_EMPTY | FLAG_W_EMPTY, 0)  # Kiểm tra: AO filled, AS & W empty
+
+
+def _is_empty(values: pd.Series) -> np.ndarray:
+    return (values.astype(str).str.strip() == '').to_numpy()
+
+
+def add_order_flags(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the KHSX status bitfield and the parsed columns every metric needs
+
+    Adds (on a copy):
+    - 'order_flags': uint8 bitfield (FLAG_*)
+    - 'So_luong_num': Số lượng ĐH as int
+    - 'TH_date': TH mới khách hàng as datetime (NaT if invalid)
+
+    Args:
+        df: Raw KHSX DataFrame (all values as strings, header row applied)
+
+    Returns:
+        New DataFrame with the three columns appended (original columns keep their positions)
+    """
+    th_dates = parse_dates(df.iloc[:, KHSX_IDX_THOI_HAN].astype(str).str.strip(), format='%d/%m/%Y')
+    q_dates = parse_dates(df.iloc[:, KHSX_IDX_NGAY_GIAO_PHOI], format='%d/%m/%Y')
+
+    flags = np.zeros(len(df), dtype=np.uint8)
+    flags |= np.where((df.iloc[:, KHSX_IDX_KH].astype(str).str.strip() == 'RRC').to_numpy(), FLAG_RRC, 0).astype(np.uint8)
+    flags |= np.where(~_is_empty(df.iloc[:, KHSX_IDX_NGAY_GIAO_PHOI]), FLAG_Q_FILLED, 0).astype(np.uint8)
+    flags |= np.where(q_dates.notna().to_numpy(), FLAG_Q_DATE, 0).astype(np.uint8)
+    flags |= np.where(~_is_empty(df.iloc[:, KHSX_IDX_NGAY_GIAO_QLCL]), FLAG_AO_FILLED, 0).astype(np.uint8)
+    flags |= np.where(_is_empty(df.iloc[:, KHSX_IDX_FIELD_AS]), FLAG_AS_EMPTY, 0).astype(np.uint8)
+    flags |= np.where(_is_empty(df.iloc[:, KHSX_IDX_FIELD_W]), FLAG_W_EMPTY, 0).astype(np.uint8)
+    flags |= np.where(th_dates.notna().to_numpy(), FLAG_TH_DATE, 0).astype(np.uint8)
+
+    df = df.copy()
+    df['order_flags'] = flags
+    df['So_luong_num'] = pd.to_numeric(
+        df.iloc[:, KHSX_IDX_SO_LUONG].astype(str).str.replace(',', ''),
+        errors='coerce'
+    ).fillna(0).astype(int)
+    df['TH_date'] = th_dates
+    return df
+
+
+def has_flags(flags, required: int = 0, forbidden: int = 0) -> np.ndarray:
+    """
+    Boolean mask of rows having ALL `required` bits set and NONE of the `forbidden` bits
+
+    Args:
+        flags: 'order_flags' column (Series or uint8 array)
+        required: OR of FLAG_* that must be set
+        forbidden: OR of FLAG_* that must be cleared
+    """
+    flags = np.asarray(flags, dtype=np.uint8)
+    return (flags & np.uint8(required | forbidden)) == np.uint8(required)
+
+
+def read_khsx_frame(
+    client,
+    sheet_url: str,
+    worksheet_name: str = 'KHSX_KHSX',
+    header_row: int = 4,
+    data_start_row: int = 5
+) -> pd.DataFrame:
+    """
+    Read the KHSX worksheet ONCE and return it with order flags (see add_order_flags)
+
+    Args:
+        client: Authenticated gspread client
+        sheet_url: Google Sheets URL
+    """
+    spreadsheet = client.open_by_url(sheet_url)
+    worksheet = spreadsheet.worksheet(worksheet_name)
+
+    all_data = worksheet.get_all_values()
+    headers = all_data[header_row - 1]
+    data_rows = all_data[data_start_row - 1:]
+    df = pd.DataFrame(data_rows, columns=headers)
+
+    return add_order_flags(df)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+KPI Engine
+Headless computation core of the dashboard: Sản xuất / Kiểm tra capacity, hàng tồn, quá hạn / tới hạn
+"""
+
+from .models import (
+    SheetFrames,
+    ProductionData,
+    ProductionCapacity,
+    DepartmentMachines,
+    QCCapacity,
+    InventoryMetrics,
+    OverdueMetrics
+)
+from .production import (
+    prepare_production_data,
+    select_deliveries,
+    production_capacity,
+    machine_breakdown
+)
+from .quality_control import select_qc_deliveries, qc_capacity
+from .orders import inventory_metrics, overdue_metrics, overdue_orders
+
+__all__ = [
+    'SheetFrames',
+    'ProductionData',
+    'ProductionCapacity',
+    'DepartmentMachines',
+    'QCCapacity',
+    'InventoryMetrics',
+    'OverdueMetrics',
+    'prepare_production_data',
+    'select_deliveries',
+    'production_capacity',
+    'machine_breakdown',
+    'select_qc_deliveries',
+    'qc_capacity',
+    'inventory_metrics',
+    'overdue_metrics',
+    'overdue_orders',
+]
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Typed inputs / outputs of the KPI engine
+"""
+
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from production_capacity_helper import DEFAULT_MASTER_MACHINES
+from sheet_sources import sheet_version
+
+
+# load_all_data_parallel key -> SheetFrames field
+SHEET_FIELDS = {
+    'GCKT_GPKT': 'gckt',
+    'PKY': 'pky',
+    'PHTCV': 'phtcv',
+    'machine_list': 'machine_list',
+    'giao_kho_vp': 'giao_kho_vp',
+    'shift_schedule': 'shift_schedule',
+    'hr_daily_head_counts': 'hr_daily_head_counts',
+    'thoi_gian_hoan_thanh': 'thoi_gian_hoan_thanh',
+    'KHSX': 'khsx',
+}
+
+
+def _frame_or_none(df) -> Optional[pd.DataFrame]:
+    return df if df is not None and not df.empty else None
+
+
+@dataclass(frozen=True)
+class SheetFrames:
+    """
+    Loaded sheets, as returned by the sheet loaders (None = missing / empty)
+
+    - gckt: GCKT_GPKT with 'ngay_giao_parsed'
+    - phtcv: PHTCV with 'date_parsed'
+    - giao_kho_vp: with 'ngay_dong_goi_parsed'
+    - hr_daily_head_counts: build_hr_head_count_table result
+    - khsx: KHSX with order flags (khsx_order_flags.add_order_flags)
+    """
+    gckt: Optional[pd.DataFrame] = None
+    pky: Optional[pd.DataFrame] = None
+    phtcv: Optional[pd.DataFrame] = None
+    machine_list: Optional[pd.DataFrame] = None
+    giao_kho_vp: Optional[pd.DataFrame] = None
+    shift_schedule: Optional[pd.DataFrame] = None
+    hr_daily_head_counts: Optional[pd.DataFrame] = None
+    thoi_gian_hoan_thanh: Optional[pd.DataFrame] = None
+    khsx: Optional[pd.DataFrame] = None
+
+    @classmethod
+    def from_sheets(cls, data: dict) -> 'SheetFrames':
+        """Build from a {sheet name: DataFrame} dict (load_all_data_parallel)"""
+        return cls(**{name: _frame_or_none(data.get(sheet)) for sheet, name in SHEET_FIELDS.items()})
+
+    @property
+    def version(self) -> str:
+        """Data version of the whole load (changes when any sheet's content changes)"""
+        return '-'.join(sheet_version(getattr(self, name))[:8] for name in SHEET_FIELDS.values())
+
+
+@dataclass(frozen=True)
+class ProductionData:
+    """Sản xuất AMJ data derived once per load (see prepare_production_data)"""
+    frames: SheetFrames
+    part_master: Optional[dict] = None            # build_pky_part_master
+    gckt_times: Optional[pd.DataFrame] = None     # calculate_gckt_processing_times, indexed like frames.gckt
+    gckt_time_by_day: pd.Series = field(default_factory=lambda: pd.Series(dtype=float))
+    gckt_days: Optional[dict] = None              # day_index of frames.gckt
+    phtcv_days: Optional[dict] = None             # day_index of frames.phtcv
+    phtcv_times: Optional[pd.DataFrame] = None    # prepare_phtcv_machine_times of phtcv_days['frame']
+
+
+@dataclass(frozen=True)
+class ProductionCapacity:
+    """Sản xuất AMJ KPIs of one selection (day / month / all)"""
+    san_luong: int = 0
+    tong_thoi_gian_gia_cong: float = 0.0
+    may_12h: int = 0                  # B
+    may_8h: int = 0                   # A = master - B
+    may_dung: int = 0
+    may_trong_phtcv: int = 0          # distinct machines in PHTCV
+    tong_may_master: int = DEFAULT_MASTER_MACHINES
+    thoi_gian_may_chay: int = 0
+    thoi_gian_may_dung: int = 0
+    cs_tong: float = 0.0
+    cs_truc_tiep: float = 0.0
+    is_monthly_average: bool = False  # cs_* are averages of the daily values
+    # GCKT rows of the selection joined with their processing times (None = CS not computed)
+    deliveries: Optional[pd.DataFrame] = None
+    # machine, dept, total_time of the machines >= 620 phút
+    machines_12h_details: pd.DataFrame = field(
+        default_factory=lambda: pd.DataFrame(columns=['machine', 'dept', 'total_time'])
+    )
+
+    @property
+    def all_12h(self) -> bool:
+        """>= 95% of the PHTCV machines ran 12h (all master machines counted as 12h)"""
+        return self.may_trong_phtcv > 0 and (self.may_12h / self.may_trong_phtcv) >= 0.95
+
+
+@dataclass(frozen=True)
+class DepartmentMachines:
+    """Máy 12h / 8h / dừng of one department on one day"""
+    department: str
+    may_12h: List[str] = field(default_factory=list)
+    may_8h: List[str] = field(default_factory=list)
+    may_dung: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.may_12h) + len(self.may_8h) + len(self.may_dung)
+
+
+@dataclass(frozen=True)
+class QCCapacity:
+    """Kiểm tra AMJ KPIs of one selection (CS only for a single day)"""
+    san_luong: int = 0
+    cs_tong: float = 0.0
+    cs_truc_tiep: float = 0.0
+    details: Dict[str, float] = field(default_factory=dict)  # calculate_quality_control_capacity result
+
+
+@dataclass(frozen=True)
+class InventoryMetrics:
+    """Hàng tồn SX / PKT (calculate_all_inventory_metrics)"""
+    rrc_inventory: int = 0
+    external_inventory: int = 0
+    rrc_pkt_inventory: int = 0
+    external_pkt_inventory: int = 0
+    inventory_by_customer: Optional[pd.DataFrame] = None
+    inventory_by_due_month: Optional[pd.DataFrame] = None
+
+    @property
+    def total_sx(self) -> int:
+        return self.rrc_inventory + self.external_inventory
+
+    @property
+    def total_pkt(self) -> int:
+        return self.rrc_pkt_inventory + self.external_pkt_inventory
+
+    @classmethod
+    def from_results(cls, results: dict) -> 'InventoryMetrics':
+        return cls(**{f.name: results[f.name] for f in fields(cls) if f.name in results})
+
+
+@dataclass(frozen=True)
+class OverdueMetrics:
+    """Quá hạn / tới hạn SX / PKT (calculate_all_overdue_metrics)"""
+    sx_rrc_overdue: int = 0
+    sx_rrc_due_soon: int = 0
+    sx_ext_overdue: int = 0
+    sx_ext_due_soon: int = 0
+    pkt_rrc_overdue: int = 0
+    pkt_rrc_due_soon: int = 0
+    pkt_ext_overdue: int = 0
+    pkt_ext_due_soon: int = 0
+    sx_rrc_actual_overdue: int = 0
+    sx_rrc_actual_due_soon: int = 0
+    pkt_rrc_actual_overdue: int = 0
+    pkt_rrc_actual_due_soon: int = 0
+    sx_horizon_curve: Optional[pd.DataFrame] = None
+    pkt_horizon_curve: Optional[pd.DataFrame] = None
+
+    @property
+    def total_sx(self) -> int:
+        return self.sx_rrc_overdue + self.sx_rrc_due_soon + self.sx_ext_overdue + self.sx_ext_due_soon
+
+    @property
+    def total_pkt(self) -> int:
+        return self.pkt_rrc_overdue + self.pkt_rrc_due_soon + self.pkt_ext_overdue + self.pkt_ext_due_soon
+
+    @classmethod
+    def from_results(cls, results: dict) -> 'OverdueMetrics':
+        return cls(**{f.name: results[f.name] for f in fields(cls) if f.name in results})
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+KHSX orders: hàng tồn, quá hạn / tới hạn
+"""
+
+import pandas as pd
+
+from calculate_all_inventory_metrics import calculate_all_inventory_metrics
+from calculate_all_overdue_metrics import calculate_all_overdue_metrics, overdue_order_list
+
+from .models import SheetFrames, InventoryMetrics, OverdueMetrics
+
+
+def inventory_metrics(frames: SheetFrames, sheet_url: str, gspread_client=None,
+                      credentials_file: str = None) -> InventoryMetrics:
+    """
+    Hàng tồn SX / PKT from the loaded KHSX frame
+    (the sheet is only read - through gspread_client / credentials_file - when frames.khsx is None)
+    """
+    results = calculate_all_inventory_metrics(
+        sheet_url=sheet_url,
+        credentials_file=credentials_file,
+        gspread_client=gspread_client,
+        df_khsx=frames.khsx
+    )
+    return InventoryMetrics.from_results(results)
+
+
+def overdue_metrics(frames: SheetFrames, sheet_url: str, gspread_client=None,
+                    credentials_file: str = None, horizon_days: int = None) -> OverdueMetrics:
+    """
+    Quá hạn / tới hạn SX / PKT from the loaded KHSX frame
+
+    Args:
+        horizon_days: If set, also compute the 'due within N days' curves (N = 0..horizon_days)
+    """
+    results = calculate_all_overdue_metrics(
+        sheet_url=sheet_url,
+        credentials_file=credentials_file,
+        gspread_client=gspread_client,
+        horizon_days=horizon_days,
+        df_khsx=frames.khsx
+    )
+    return OverdueMetrics.from_results(results)
+
+
+def overdue_orders(frames: SheetFrames, today=None) -> dict:
+    """
+    Orders behind the quá hạn / tới hạn SX / PKT metrics (empty lists when KHSX is not loaded)
+
+    Returns:
+        {'sx': DataFrame, 'pkt': DataFrame}, see calculate_all_overdue_metrics.overdue_order_list
+    """
+    if frames.khsx is None or frames.khsx.empty:
+        return {'sx': pd.DataFrame(), 'pkt': pd.DataFrame()}
+    return overdue_order_list(frames.khsx, today=today)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Sản xuất AMJ: sản lượng, CS tổng, CS trực tiếp, máy 12h / 8h / dừng
+"""
+
+from typing import Dict, Optional
+
+import pandas as pd
+
+from production_capacity_helper import (
+    DEPT_SX1,
+    DEPT_SX2,
+    calculate_gckt_processing_times,
+    processing_time_by_day,
+    prepare_phtcv_machine_times,
+    calculate_production_capacity_period,
+    calculate_production_capacity_range,
+    classify_machines_by_department
+)
+from day_index import build_day_index, day_slice, month_slice
+from daily_kpi_store import DEPARTMENT_SX, read_daily_kpis
+
+from .models import SheetFrames, ProductionData, ProductionCapacity, DepartmentMachines
+
+
+def prepare_production_data(frames: SheetFrames, part_master: Optional[dict]) -> ProductionData:
+    """
+    Derive everything the Sản xuất KPIs need, once per data load
+
+    - processing time of every GCKT delivery (gathered from the PKY part master)
+    - day indexes of GCKT_GPKT and PHTCV
+    - per-row PHTCV machine times
+    """
+    gckt = frames.gckt
+    if gckt is None:
+        return ProductionData(frames=frames, part_master=part_master)
+
+    gckt_times = None
+    gckt_time_by_day = pd.Series(dtype=float)
+    if part_master is not None and 'ten_chi_tiet' in gckt.columns and 'sl_giao' in gckt.columns:
+        gckt_times = calculate_gckt_processing_times(gckt, part_master)
+        if 'ngay_giao_parsed' in gckt.columns:
+            gckt_time_by_day = processing_time_by_day(gckt, gckt_times)
+
+    gckt_days = build_day_index(gckt, 'ngay_giao_parsed') if 'ngay_giao_parsed' in gckt.columns else None
+
+    phtcv_days = None
+    phtcv_times = None
+    if frames.phtcv is not None and 'date_parsed' in frames.phtcv.columns:
+        phtcv_days = build_day_index(frames.phtcv, 'date_parsed')
+        phtcv_times = prepare_phtcv_machine_times(phtcv_days['frame'])
+
+    return ProductionData(
+        frames=frames,
+        part_master=part_master,
+        gckt_times=gckt_times,
+        gckt_time_by_day=gckt_time_by_day,
+        gckt_days=gckt_days,
+        phtcv_days=phtcv_days,
+        phtcv_times=phtcv_times
+    )
+
+
+def select_deliveries(data: ProductionData, date=None, month=None) -> pd.DataFrame:
+    """GCKT_GPKT rows of a day / month / everything (positional slices of the day index)"""
+    if data.gckt_days is None:
+        return data.frames.gckt if data.frames.gckt is not None else pd.DataFrame()
+    if date is not None:
+        return day_slice(data.gckt_days, date)
+    if month is not None:
+        return month_slice(data.gckt_days, month)
+    return data.frames.gckt
+
+
+def _phtcv_times_of(data: ProductionData, date=None, month=None) -> pd.DataFrame:
+    """Prepared PHTCV rows of a day / month / everything (aligned with the day index frame)"""
+    if date is not None:
+        rows = day_slice(data.phtcv_days, date)
+    elif month is not None:
+        rows = month_slice(data.phtcv_days, month)
+    else:
+        return data.phtcv_times
+    return data.phtcv_times.loc[rows.index]
+
+
+def production_capacity(data: ProductionData, date=None, month=None,
+                        kpi_store: Optional[pd.DataFrame] = None) -> ProductionCapacity:
+    """
+    Sản xuất AMJ KPIs of the dashboard selection
+
+    Args:
+        data: prepare_production_data result
+        date: Single day (anything accepted by pd.Timestamp); takes precedence over month
+        month: 'YYYY-MM' / pd.Period - CS tổng / trực tiếp are the averages of the daily values
+        kpi_store: Daily KPI store; monthly averages are read from it when given,
+            otherwise the month is computed with calculate_production_capacity_range
+
+    Returns:
+        ProductionCapacity (CS = 0 when PKY / PHTCV are missing)
+    """
+    if date is not None:
+        date = pd.Timestamp(date).normalize()
+        month = None
+
+    deliveries = select_deliveries(data, date, month)
+    if 'sl_giao' in deliveries.columns:
+        san_luong = int(pd.to_numeric(
+            deliveries['sl_giao'].astype(str).str.replace(',', '.'),
+            errors='coerce'
+        ).fillna(0).sum())
+    else:
+        san_luong = 0
+
+    if data.gckt_times is None or data.phtcv_times is None or data.frames.pky is None:
+        return ProductionCapacity(san_luong=san_luong)
+
+    period = calculate_production_capacity_period(
+        data.gckt_times.loc[deliveries.index],
+        data.frames.machine_list,
+        _phtcv_times_of(data, date, month)
+    )
+    kpis = dict(
+        san_luong=san_luong,
+        tong_thoi_gian_gia_cong=float(period['tong_thoi_gian_gia_cong']),
+        may_12h=int(period['may_12h']),
+        may_8h=int(period['may_8h']),
+        may_dung=int(period['may_dung']),
+        may_trong_phtcv=int(period['may_trong_phtcv']),
+        tong_may_master=int(period['tong_may_master']),
+        thoi_gian_may_chay=int(period['thoi_gian_may_chay']),
+        thoi_gian_may_dung=int(period['thoi_gian_may_dung']),
+        cs_tong=float(period['cs_tong']),
+        cs_truc_tiep=float(period['cs_truc_tiep']),
+        deliveries=deliveries.join(data.gckt_times),
+        machines_12h_details=period['machines_12h_details'],
+    )
+
+    if month is not None:
+        # Monthly CS = average of the days having both PHTCV rows and deliveries
+        month_period = pd.Period(month, freq='M')
+        start_date, end_date = month_period.start_time, month_period.end_time
+        if kpi_store is not None:
+            daily = read_daily_kpis(kpi_store, DEPARTMENT_SX, start_date, end_date)
+        else:
+            daily = calculate_production_capacity_range(
+                data.phtcv_days['frame'], data.frames.gckt, data.gckt_times,
+                data.frames.machine_list, start_date, end_date, phtcv_times=data.phtcv_times
+            )
+        kpis['cs_tong'] = float(daily['cs_tong'].mean()) if not daily.empty else 0.0
+        kpis['cs_truc_tiep'] = float(daily['cs_truc_tiep'].mean()) if not daily.empty else 0.0
+        kpis['is_monthly_average'] = True
+
+    return ProductionCapacity(**kpis)
+
+
+def machine_breakdown(data: ProductionData, date) -> Dict[str, DepartmentMachines]:
+    """Máy 12h / 8h / dừng per Sản xuất 1 / 2 on one day ({} if PHTCV is missing)"""
+    if data.phtcv_times is None:
+        return {}
+    classified = classify_machines_by_department(
+        _phtcv_times_of(data, date=pd.Timestamp(date).normalize()),
+        data.frames.machine_list
+    )
+    return {
+        department: DepartmentMachines(department=department, **classified[department])
+        for department in (DEPT_SX1, DEPT_SX2)
+    }
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra AMJ: sản lượng, CS tổng, CS trực tiếp
+"""
+
+import pandas as pd
+
+from qc_capacity_helper import calculate_quality_control_capacity
+from day_index import build_day_index, day_slice, month_slice
+
+from .models import SheetFrames, QCCapacity
+
+
+def select_qc_deliveries(frames: SheetFrames, date=None, month=None) -> pd.DataFrame:
+    """giao_kho_vp rows of a day / month / everything"""
+    df_giao_kho_vp = frames.giao_kho_vp
+    if df_giao_kho_vp is None or 'ngay_dong_goi_parsed' not in df_giao_kho_vp.columns:
+        return pd.DataFrame()
+    if date is None and month is None:
+        return df_giao_kho_vp
+
+    giao_kho_days = build_day_index(df_giao_kho_vp, 'ngay_dong_goi_parsed')
+    if date is not None:
+        return day_slice(giao_kho_days, date)
+    return month_slice(giao_kho_days, month)
+
+
+def qc_capacity(frames: SheetFrames, date=None, month=None) -> QCCapacity:
+    """
+    Kiểm tra AMJ KPIs of the dashboard selection
+
+    Args:
+        frames: Loaded sheets
+        date: Single day; CS tổng / trực tiếp are only computed for a day
+        month: 'YYYY-MM' / pd.Period (sản lượng only)
+    """
+    if date is not None:
+        date = pd.Timestamp(date).normalize()
+        month = None
+
+    deliveries = select_qc_deliveries(frames, date, month)
+    if 'sll' in deliveries.columns:
+        san_luong = int(pd.to_numeric(
+            deliveries['sll'].astype(str).str.replace(',', '.'),
+            errors='coerce'
+        ).fillna(0).sum())
+    else:
+        san_luong = 0
+
+    if date is None:
+        return QCCapacity(san_luong=san_luong)
+
+    result = calculate_quality_control_capacity(
+        deliveries,
+        frames.shift_schedule,
+        frames.hr_daily_head_counts,
+        frames.thoi_gian_hoan_thanh,
+        date.strftime('%d/%m/%Y')
+    )
+    return QCCapacity(
+        san_luong=san_luong,
+        cs_tong=float(result['cs_tong']),
+        cs_truc_tiep=float(result['cs_truc_tiep']),
+        details=result
+    )
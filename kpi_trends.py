@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-period KPI trends
+Quarter / year / custom range trends with weekly and monthly rollups, built on
+the daily rows of the KPI store (daily_kpi_store) - the cost of a trend is a
+slice + one groupby, so a year renders as fast as a month.
+"""
+
+import pandas as pd
+
+from daily_kpi_store import read_daily_kpis
+
+
+# Trend range options (label -> pandas period frequency, None = custom range)
+TREND_RANGE_OPTIONS = {
+    'Tháng': 'M',
+    'Quý': 'Q',
+    'Năm': 'Y',
+    'Tùy chọn': None,
+}
+
+# Rollup options (label -> granularity)
+TREND_GRANULARITY_OPTIONS = {
+    'Ngày': 'D',
+    'Tuần': 'W',
+    'Tháng': 'M',
+}
+
+# KPI -> aggregation of the daily values inside one rollup bucket
+ROLLUP_AGGREGATIONS = {
+    'san_luong': 'sum',       # Sản lượng cộng dồn
+    'cs_tong': 'mean',        # CS = trung bình các ngày có dữ liệu
+    'cs_truc_tiep': 'mean',
+    'may_12h': 'mean',
+    'may_8h': 'mean',
+    'may_dung': 'mean',
+}
+
+PREVIOUS_YEAR_SUFFIX = '_nam_truoc'
+
+
+def period_options(days, freq: str) -> list:
+    """Distinct periods (pd.Period of freq) covering `days`, newest first"""
+    return sorted(pd.DatetimeIndex(days).to_period(freq).unique(), reverse=True)
+
+
+def period_date_range(period) -> tuple:
+    """(start, end) days of a pd.Period"""
+    return period.start_time.normalize(), period.end_time.normalize()
+
+
+def bucket_start(dates: pd.Series, granularity: str) -> pd.Series:
+    """First day of the rollup bucket of every date (weeks start on Monday)"""
+    if granularity == 'D':
+        return dates.dt.normalize()
+    if granularity == 'W':
+        return dates.dt.to_period('W-SUN').dt.start_time
+    if granularity == 'M':
+        return dates.dt.to_period('M').dt.start_time
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def rollup_daily_kpis(daily: pd.DataFrame, granularity: str) -> pd.DataFrame:
+    """
+    Roll daily KPI rows up to days / weeks / months
+
+    Args:
+        daily: Daily KPI rows ('date' + KPI columns), e.g. read_daily_kpis
+        granularity: 'D', 'W' or 'M'
+
+    Returns:
+        DataFrame with 'date' (first day of the bucket), 'so_ngay' (days with
+        data in the bucket) and the KPI columns aggregated per ROLLUP_AGGREGATIONS
+    """
+    kpi_columns = [column for column in ROLLUP_AGGREGATIONS if column in daily.columns]
+    if daily.empty:
+        rolled = pd.DataFrame(columns=['date', 'so_ngay'] + kpi_columns)
+        rolled['date'] = pd.to_datetime(rolled['date'])  # .dt stays usable on an empty rollup
+        return rolled
+
+    values = daily[kpi_columns].apply(pd.to_numeric, errors='coerce')
+    grouped = values.groupby(bucket_start(daily['date'], granularity).rename('date'))
+    rolled = grouped.agg({column: ROLLUP_AGGREGATIONS[column] for column in kpi_columns})
+    rolled.insert(0, 'so_ngay', grouped.size())
+    return rolled.reset_index()
+
+
+def previous_year_offset(granularity: str):
+    """Shift that maps last year's buckets onto this year's (52 weeks for weekly)"""
+    return pd.DateOffset(weeks=52) if granularity == 'W' else pd.DateOffset(years=1)
+
+
+def build_kpi_trend(store: pd.DataFrame, department: str, start_date, end_date,
+                    granularity: str = 'D', compare_previous_year: bool = False) -> dict:
+    """
+    Trend of one department over [start_date, end_date]
+
+    Args:
+        store: KPI store (daily_kpi_store.load_kpi_store / refresh_*)
+        department: DEPARTMENT_SX / DEPARTMENT_QC
+        granularity: 'D', 'W' or 'M'
+        compare_previous_year: Add '<kpi>_nam_truoc' columns (same buckets one year earlier)
+
+    Returns:
+        dict with:
+        - 'daily': daily KPI rows of the range
+        - 'trend': rolled-up rows (see rollup_daily_kpis)
+    """
+    daily = read_daily_kpis(store, department, start_date, end_date)
+    trend = rollup_daily_kpis(daily, granularity)
+
+    if compare_previous_year and not trend.empty:
+        offset = previous_year_offset(granularity)
+        previous_daily = read_daily_kpis(
+            store, department,
+            pd.Timestamp(start_date) - offset, pd.Timestamp(end_date) - offset
+        )
+        previous = rollup_daily_kpis(previous_daily, granularity)
+        if previous.empty:
+            # No stored rows a year earlier (first year of the store): empty comparison columns
+            trend = trend.assign(**{
+                column + PREVIOUS_YEAR_SUFFIX: float('nan')
+                for column in ROLLUP_AGGREGATIONS if column in trend.columns
+            })
+        else:
+            previous['date'] = bucket_start(previous['date'] + offset, granularity)
+            previous = previous.groupby('date', as_index=False).first()  # Feb 29 / week 53 collisions
+            trend = trend.merge(
+                previous.drop(columns=['so_ngay']).add_suffix(PREVIOUS_YEAR_SUFFIX)
+                .rename(columns={'date' + PREVIOUS_YEAR_SUFFIX: 'date'}),
+                on='date', how='left'
+            )
+
+    return {'daily': daily, 'trend': trend}
+
+
+def format_trend_labels(dates: pd.Series, granularity: str) -> pd.Series:
+    """x-axis labels: dd/mm/yyyy (ngày), 'Tuần dd/mm/yyyy' (tuần), mm/yyyy (tháng)"""
+    if granularity == 'W':
+        return 'Tuần ' + dates.dt.strftime('%d/%m/%Y')
+    if granularity == 'M':
+        return dates.dt.strftime('%m/%Y')
+    return dates.dt.strftime('%d/%m/%Y')
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics Endpoint
+Prometheus text-format metrics of the dashboard process (GET /metrics)
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import perf_stats
+from quota_budget import sheets_budget
+
+
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_METRICS_PORT = 9108
+METRICS_PREFIX = 'baocao_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# perf_stats counter -> (metric name, label name, help)
+COUNTER_METRICS = {
+    'api_calls': ('sheets_api_calls_total', 'sheet', 'Sheets API HTTP responses'),
+    'api_bytes': ('sheets_api_bytes_total', 'sheet', 'Bytes received from the Sheets API'),
+    'api_retries': ('sheets_api_retries_total', 'sheet', 'Retries after a quota error (retry_with_backoff)'),
+    'api_quota_errors': ('sheets_api_quota_errors_total', 'sheet', 'Quota / rate limit errors from the Sheets API'),
+    'quota_deferred': ('sheet_fetches_deferred_total', 'sheet', 'Sheet refreshes deferred while the quota budget was low'),
+    'loader_hits': ('cache_hits_total', 'loader', 'Cached loader calls served from the cache'),
+    'loader_misses': ('cache_misses_total', 'loader', 'Cached loader calls that ran the loader'),
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _family(lines: list, name: str, metric_type: str, help_text: str):
+    lines.append(f'# HELP {METRICS_PREFIX}{name} {help_text}')
+    lines.append(f'# TYPE {METRICS_PREFIX}{name} {metric_type}')
+
+
+def render_metrics(now: float = None) -> str:
+    """Current metrics in the Prometheus text exposition format"""
+    now = time.time() if now is None else now
+    counters = perf_stats.counters()
+    gauges = perf_stats.gauges()
+    lines = []
+
+    for metric, (name, label_name, help_text) in COUNTER_METRICS.items():
+        _family(lines, name, 'counter', help_text)
+        for (key_metric, label), value in sorted(counters.items()):
+            if key_metric == metric:
+                lines.append(f'{METRICS_PREFIX}{name}{{{label_name}="{_escape(label)}"}} {_format_value(value)}')
+
+    _family(lines, 'sheets_api_calls_per_minute', 'gauge', 'Sheets API calls of the last 60 seconds, per minute')
+    lines.append(f'{METRICS_PREFIX}sheets_api_calls_per_minute {_format_value(perf_stats.api_calls_per_minute())}')
+
+    budgets = sorted(sheets_budget.snapshot().items())
+    _family(lines, 'sheets_quota_remaining', 'gauge', 'Sheets API calls left in the 60 s quota window of the credential')
+    for credential, budget in budgets:
+        lines.append(f'{METRICS_PREFIX}sheets_quota_remaining{{credential="{_escape(credential)}"}} {budget["remaining"]}')
+    _family(lines, 'sheets_quota_wait_seconds_total', 'counter', 'Seconds API calls waited for the quota budget')
+    for credential, budget in budgets:
+        lines.append(
+            f'{METRICS_PREFIX}sheets_quota_wait_seconds_total{{credential="{_escape(credential)}"}} '
+            f'{budget["waited_seconds"]:.3f}'
+        )
+
+    loaded_at = {label: value for (metric, label), value in gauges.items() if metric == 'sheet_loaded_at'}
+    _family(lines, 'sheet_cache_age_seconds', 'gauge', 'Seconds since the cached frame of the sheet was loaded')
+    for sheet, timestamp in sorted(loaded_at.items()):
+        lines.append(f'{METRICS_PREFIX}sheet_cache_age_seconds{{sheet="{_escape(sheet)}"}} {now - timestamp:.3f}')
+    _family(lines, 'sheet_rows', 'gauge', 'Rows of the cached frame of the sheet')
+    for (metric, sheet), value in sorted(gauges.items()):
+        if metric == 'sheet_rows':
+            lines.append(f'{METRICS_PREFIX}sheet_rows{{sheet="{_escape(sheet)}"}} {_format_value(value)}')
+
+    _family(lines, 'render_seconds', 'histogram', 'Render time of the page (rerun) and of each section')
+    for (metric, section), histogram in sorted(perf_stats.histograms().items()):
+        if metric != 'render_seconds':
+            continue
+        label = f'section="{_escape(section)}"'
+        for upper_bound, bucket_count in zip(perf_stats.LATENCY_BUCKETS, histogram['buckets']):
+            lines.append(f'{METRICS_PREFIX}render_seconds_bucket{{{label},le="{upper_bound}"}} {bucket_count}')
+        lines.append(f'{METRICS_PREFIX}render_seconds_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{METRICS_PREFIX}render_seconds_sum{{{label}}} {histogram["sum"]:.6f}')
+        lines.append(f'{METRICS_PREFIX}render_seconds_count{{{label}}} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics (and /) -> render_metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds - keep the dashboard log clean
+
+
+def serve_metrics(host: str = DEFAULT_METRICS_HOST, port: int = DEFAULT_METRICS_PORT) -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a daemon thread of this process
+
+    Returns:
+        The running server (server.shutdown() stops it); raises OSError if the port is taken
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-endpoint', daemon=True)
+    thread.start()
+    return server
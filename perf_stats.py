@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Performance Stats
+API call / cache counters and per-rerun timings of the dashboard
+"""
+
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# Label of API calls made outside an api_scope (authentication, KHSX fallback reads, ...)
+OTHER_SCOPE = 'khác'
+
+# Upper bounds (seconds) of the latency histogram buckets (+Inf implied)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Sliding window of the API call rate
+API_RATE_WINDOW_SECONDS = 60
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+_api_call_times = deque(maxlen=100000)
+_scope = threading.local()
+_active_run = contextvars.ContextVar('perf_stats_run', default=None)
+
+
+def count(metric: str, label: str, value: float = 1):
+    """Add value to the (metric, label) counter, and to the active RunStats of this thread"""
+    with _lock:
+        _counters[(metric, label)] += value
+    run = _active_run.get()
+    if run is not None:
+        run.add(metric, label, value)
+
+
+def counters() -> dict:
+    """Copy of every counter {(metric, label): value}"""
+    with _lock:
+        return dict(_counters)
+
+
+def set_gauge(metric: str, label: str, value: float):
+    """Set the (metric, label) gauge"""
+    with _lock:
+        _gauges[(metric, label)] = value
+
+
+def gauges() -> dict:
+    """Copy of every gauge {(metric, label): value}"""
+    with _lock:
+        return dict(_gauges)
+
+
+def observe(metric: str, label: str, seconds: float):
+    """Add one observation to the (metric, label) histogram (LATENCY_BUCKETS)"""
+    with _lock:
+        histogram = _histograms.get((metric, label))
+        if histogram is None:
+            histogram = _histograms[(metric, label)] = {
+                'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0
+            }
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper_bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def histograms() -> dict:
+    """Copy of every histogram {(metric, label): {'buckets' (cumulative), 'sum', 'count'}}"""
+    with _lock:
+        return {
+            key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+            for key, h in _histograms.items()
+        }
+
+
+def api_calls_per_minute(window: float = API_RATE_WINDOW_SECONDS) -> float:
+    """Sheets API calls of the last `window` seconds, per minute"""
+    cutoff = time.time() - window
+    recent = 0
+    with _lock:
+        for called_at in reversed(_api_call_times):  # newest first, stop at the window start
+            if called_at < cutoff:
+                break
+            recent += 1
+    return recent * 60.0 / window
+
+
+@contextmanager
+def api_scope(label: str):
+    """Attribute the API calls made by this thread inside the block to label"""
+    previous = getattr(_scope, 'label', None)
+    _scope.label = label
+    try:
+        yield
+    finally:
+        _scope.label = previous
+
+
+def current_scope() -> str:
+    return getattr(_scope, 'label', None) or OTHER_SCOPE
+
+
+@contextmanager
+def timed(metric: str, label: str):
+    """Add the seconds spent in the block to the (metric, label) counter"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(metric, label, time.perf_counter() - start)
+
+
+def _count_response(response, *args, **kwargs):
+    """requests response hook: one API call + its body size, for the current scope"""
+    label = current_scope()
+    count('api_calls', label)
+    count('api_bytes', label, len(response.content or b''))
+    with _lock:
+        _api_call_times.append(time.time())
+    return response
+
+
+def instrument_client(client):
+    """Count every HTTP response of a gspread client (gspread 5 / 6 sessions), returns client"""
+    http_client = getattr(client, 'http_client', None)
+    session = getattr(http_client, 'session', None) or getattr(client, 'session', None)
+    hooks = getattr(session, 'hooks', None)
+    if hooks is not None:
+        response_hooks = hooks.setdefault('response', [])
+        if _count_response not in response_hooks:
+            response_hooks.append(_count_response)
+    return client
+
+
+def _cache_status(loader: dict) -> str:
+    if not loader:
+        return ''
+    if loader.get('deferred'):
+        return 'Hoãn'
+    return 'Hit' if loader['hit'] else 'Miss'
+
+
+class RunStats:
+    """
+    Timings of one dashboard rerun
+
+    Stages (authentication, data load, ...) accumulate; a section keeps the time of
+    its latest run (fragments rerun on their own). Loaders record cache hit / miss:
+    a miss is a loader body that ran for this run, i.e. bumped its 'loader_misses'
+    counter while the run was active. Other sessions' loads and API calls are not
+    counted (they only go to the process-wide counters).
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages = {}
+        self.sections = {}
+        self.loaders = {}
+        self.changes = {}
+        self._counts = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, metric: str, label: str, value: float = 1):
+        """Counter increment made by this run (see count)"""
+        with self._lock:
+            self._counts[(metric, label)] += value
+
+    def activate(self):
+        """Count this thread's counter increments for this run (until another run is activated)"""
+        _active_run.set(self)
+
+    @contextmanager
+    def active(self):
+        """Count the counter increments of the block for this run (e.g. in a pool thread)"""
+        token = _active_run.set(self)
+        try:
+            yield
+        finally:
+            _active_run.reset(token)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.sections[name] = elapsed
+            observe('render_seconds', name, elapsed)
+
+    def loaded(self, label: str, loader):
+        """Call a cached loader, recording its time and whether it hit the cache"""
+        misses_before = self._counts.get(('loader_misses', label), 0)
+        start = time.perf_counter()
+        with self.active():
+            result = loader()
+        elapsed = time.perf_counter() - start
+        hit = self._counts.get(('loader_misses', label), 0) == misses_before
+        if hit:
+            count('loader_hits', label)
+        with self._lock:
+            self.loaders[label] = {'hit': hit, 'seconds': elapsed}
+        return result
+
+    def deferred(self, label: str):
+        """Record a loader whose fetch was deferred (quota budget low, last frame served)"""
+        with self._lock:
+            self.loaders[label] = {'hit': False, 'deferred': True, 'seconds': 0.0}
+
+    def finish(self):
+        """Capture the counter increments of this rerun (API calls, bytes, fetch / build time)"""
+        with self._lock:
+            self.changes = dict(self._counts)
+
+    @property
+    def total_seconds(self) -> float:
+        return time.time() - self.started_at
+
+    def change(self, metric: str, label: str = None) -> float:
+        """Increment of one counter during the rerun (all labels summed if label is None)"""
+        return sum(
+            value for (key_metric, key_label), value in self.changes.items()
+            if key_metric == metric and (label is None or key_label == label)
+        )
+
+    def stage_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            [(name, round(seconds, 3)) for name, seconds in self.stages.items()],
+            columns=['Giai đoạn', 'Thời gian (s)']
+        )
+
+    def section_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            [(name, round(seconds, 3)) for name, seconds in self.sections.items()],
+            columns=['Section', 'Thời gian (s)']
+        )
+
+    def loader_frame(self) -> pd.DataFrame:
+        """One row per loader: cache, time, API calls / KB and fetch / build time of this rerun"""
+        labels = list(self.loaders)
+        if any(label == OTHER_SCOPE for (_, label) in self.changes):
+            labels.append(OTHER_SCOPE)
+        rows = []
+        for label in labels:
+            loader = self.loaders.get(label)
+            rows.append({
+                'Nguồn': label,
+                'Cache': _cache_status(loader),
+                'Thời gian (s)': round(loader['seconds'], 3) if loader else None,
+                'API calls': int(self.change('api_calls', label)),
+                'KB nhận': round(self.change('api_bytes', label) / 1024, 1),
+                'Tải (s)': round(self.change('fetch_seconds', label), 3),
+                'Dựng DataFrame (s)': round(self.change('build_seconds', label), 3),
+            })
+        return pd.DataFrame(rows)
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for Production (Sản xuất AMJ) Capacity Calculation
+
+PKY part master: ten_chi_tiet strings are interned ONCE into integer part IDs
+(positions in the deduplicated PKY), so the per-delivery processing time
+    (sl_giao × thoi_gian_pky + tong_so_nc × 40) × 1.2
+is an array gather instead of a string-keyed merge of GCKT with PKY.
+"""
+
+import pandas as pd
+import numpy as np
+
+from span_log import traced
+
+
+# Processing time formula constants
+SETUP_MINUTES_PER_NC = 40     # phút chuẩn bị cho mỗi nguyên công (tong_so_nc)
+PROCESSING_TIME_FACTOR = 1.2  # hệ số thời gian gia công
+
+MISSING_PART_ID = -1
+
+
+def _to_number(values: pd.Series) -> pd.Series:
+    """Sheet text -> float (decimal comma allowed), invalid/empty -> 0"""
+    return pd.to_numeric(values.astype(str).str.replace(',', '.'), errors='coerce').fillna(0)
+
+
+def build_pky_part_master(df_pky: pd.DataFrame) -> dict:
+    """
+    Build the PKY part master once per PKY version
+
+    Duplicated ten_chi_tiet keep their FIRST occurrence (same as the former
+    drop_duplicates before merging).
+
+    Args:
+        df_pky: DataFrame from PKY sheet (ten_chi_tiet, thoi_gian_pky, tong_so_nc)
+
+    Returns:
+        dict with:
+        - 'part_index': pd.Index of unique ten_chi_tiet (position = part ID)
+        - 'thoi_gian_pky': float array, one value per part ID plus a trailing 0
+        - 'tong_so_nc': float array, one value per part ID plus a trailing 0
+        The trailing 0 makes MISSING_PART_ID (-1) gather 0, like fillna(0) after a left merge.
+        None if PKY has no ten_chi_tiet / thoi_gian_pky columns.
+    """
+    if df_pky is None or df_pky.empty:
+        return None
+    if 'ten_chi_tiet' not in df_pky.columns or 'thoi_gian_pky' not in df_pky.columns:
+        return None
+
+    df_unique = df_pky.drop_duplicates(subset=['ten_chi_tiet'], keep='first')
+
+    thoi_gian_pky = _to_number(df_unique['thoi_gian_pky']).to_numpy(dtype=float)
+    if 'tong_so_nc' in df_unique.columns:
+        tong_so_nc = _to_number(df_unique['tong_so_nc']).to_numpy(dtype=float)
+    else:
+        tong_so_nc = np.zeros(len(df_unique))
+
+    return {
+        'part_index': pd.Index(df_unique['ten_chi_tiet']),
+        'thoi_gian_pky': np.append(thoi_gian_pky, 0.0),
+        'tong_so_nc': np.append(tong_so_nc, 0.0),
+    }
+
+
+def intern_part_ids(part_master: dict, ten_chi_tiet) -> np.ndarray:
+    """
+    Map ten_chi_tiet strings to integer part IDs
+
+    Returns:
+        int array aligned with ten_chi_tiet, MISSING_PART_ID for parts not in PKY
+    """
+    return part_master['part_index'].get_indexer(ten_chi_tiet)
+
+
+def calculate_processing_times(part_master: dict, part_ids: np.ndarray, sl_giao: np.ndarray) -> np.ndarray:
+    """
+    Vectorized processing time per delivery: (sl_giao × thoi_gian_pky + tong_so_nc × 40) × 1.2
+
+    Args:
+        part_master: Result of build_pky_part_master
+        part_ids: Result of intern_part_ids
+        sl_giao: Delivered quantity per delivery (float)
+
+    Returns:
+        float array of processing time (phút), aligned with part_ids
+    """
+    thoi_gian_pky = part_master['thoi_gian_pky'][part_ids]
+    tong_so_nc = part_master['tong_so_nc'][part_ids]
+    return (sl_giao * thoi_gian_pky + tong_so_nc * SETUP_MINUTES_PER_NC) * PROCESSING_TIME_FACTOR
+
+
+def calculate_gckt_processing_times(df_gckt: pd.DataFrame, part_master: dict) -> pd.DataFrame:
+    """
+    Processing time of every GCKT_GPKT delivery (one gather over the whole sheet)
+
+    Args:
+        df_gckt: DataFrame from GCKT_GPKT sheet (ten_chi_tiet, sl_giao)
+        part_master: Result of build_pky_part_master
+
+    Returns:
+        DataFrame indexed like df_gckt with columns 'sl_giao_numeric',
+        'thoi_gian_numeric', 'tong_so_nc_numeric', 'total_time'
+    """
+    part_ids = intern_part_ids(part_master, df_gckt['ten_chi_tiet'])
+    sl_giao = _to_number(df_gckt['sl_giao']).to_numpy(dtype=float)
+
+    return pd.DataFrame({
+        'sl_giao_numeric': sl_giao,
+        'thoi_gian_numeric': part_master['thoi_gian_pky'][part_ids],
+        'tong_so_nc_numeric': part_master['tong_so_nc'][part_ids],
+        'total_time': calculate_processing_times(part_master, part_ids, sl_giao),
+    }, index=df_gckt.index)
+
+
+def processing_time_by_day(df_gckt: pd.DataFrame, gckt_times: pd.DataFrame) -> pd.Series:
+    """
+    Total processing time (tong_thoi_gian_gia_cong) per delivery day
+
+    Returns:
+        Series indexed by normalized ngay_giao date; days without deliveries are absent
+    """
+    days = df_gckt['ngay_giao_parsed'].dt.normalize()
+    return gckt_times['total_time'].groupby(days).sum()
+
+
+# =====================================================================
+# CS tổng / CS trực tiếp (PHTCV machine times), vectorized over a date range
+# =====================================================================
+
+SHIFT_STOP_TIMES = [420, 630, 660]  # dừng / dừng khác equal to a whole shift are not counted
+MACHINE_12H_MINUTES = 620           # machine (in one department) >= 620 phút -> chạy 12h
+ALL_12H_RATIO = 0.95                # >= 95% machines 12h -> all master machines run 12h
+SHIFT_12H_MINUTES = 20 * 60
+SHIFT_8H_MINUTES = 14 * 60
+STOPPED_MACHINE_MINUTES = 7 * 60
+STOPPED_MIN_STOP_MINUTES = 420      # máy dừng: dừng / dừng khác >= 420 and no production
+DEFAULT_MASTER_MACHINES = 100       # fallback when machine_list is missing
+
+DEPT_SX1 = 'Sản xuất 1'
+DEPT_SX2 = 'Sản xuất 2'
+
+PRODUCTION_CAPACITY_RANGE_COLUMNS = [
+    'date', 'san_luong', 'tong_thoi_gian_gia_cong', 'may_12h', 'may_8h', 'may_dung',
+    'thoi_gian_may_chay', 'thoi_gian_may_dung', 'cs_tong', 'cs_truc_tiep'
+]
+
+
+def _phtcv_number(df: pd.DataFrame, column: str, default: float) -> pd.Series:
+    """PHTCV text column -> float (NaN kept); missing column -> default"""
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=float)
+    return pd.to_numeric(df[column].astype(str).str.replace(',', '.'), errors='coerce')
+
+
+def get_master_machines(df_machine_list: pd.DataFrame):
+    """
+    Machine master list
+
+    Returns:
+        (total_machines_master, set of stripped machine numbers)
+        total_machines_master counts every non-empty row (DEFAULT_MASTER_MACHINES if no list)
+    """
+    if df_machine_list is None or df_machine_list.empty or 'số máy' not in df_machine_list.columns:
+        return DEFAULT_MASTER_MACHINES, set()
+
+    machines = df_machine_list['số máy'].astype(str).str.strip()
+    machines = machines[machines != '']
+    return len(machines), set(machines)
+
+
+def prepare_phtcv_machine_times(df_phtcv: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-row machine times of PHTCV (computed once, reused by every day)
+
+    row_total_time = gia công × sl + gá lắp × sl + tgcb + chạy thử + dừng + dừng khác + sửa
+    (sl thực tế empty/0 -> 1; dừng / dừng khác equal to a shift time -> 0)
+
+    Returns:
+        DataFrame indexed like df_phtcv with 'day', 'machine' (stripped),
+        'machine_exact' (số máy has no surrounding spaces), 'dept' (stripped),
+        'dept_group' (1 = Sản xuất 1, 2 = Sản xuất 2, 0 = other), 'row_total_time'
+        and the raw values used by the stopped-machine rule
+    """
+    machine_raw = df_phtcv['số máy'].astype(str) if 'số máy' in df_phtcv.columns else pd.Series('', index=df_phtcv.index)
+    dept = df_phtcv['bộ phận'].astype(str).str.strip() if 'bộ phận' in df_phtcv.columns else pd.Series('', index=df_phtcv.index)
+    machine = machine_raw.str.strip()
+
+    sl_thuc_te = _phtcv_number(df_phtcv, 'sl thực tế', 1)
+    sl_thuc_te = sl_thuc_te.where(sl_thuc_te.notna() & (sl_thuc_te != 0), 1)
+
+    tgcb = _phtcv_number(df_phtcv, 'tgcb', 0).fillna(0)
+    chay_thu = _phtcv_number(df_phtcv, 'chạy thử', 0).fillna(0)
+    ga_lap = _phtcv_number(df_phtcv, 'gá lắp', 0).fillna(0)
+    gia_cong = _phtcv_number(df_phtcv, 'gia công', 0).fillna(0)
+    dung = _phtcv_number(df_phtcv, 'dừng', 0).fillna(0)
+    dung_khac = _phtcv_number(df_phtcv, 'dừng khác', 0).fillna(0)
+    sua = _phtcv_number(df_phtcv, 'sửa', 0).fillna(0)
+
+    row_total_time = (
+        gia_cong * sl_thuc_te + ga_lap * sl_thuc_te + tgcb + chay_thu +
+        dung.where(~dung.isin(SHIFT_STOP_TIMES), 0) +
+        dung_khac.where(~dung_khac.isin(SHIFT_STOP_TIMES), 0) +
+        sua
+    )
+
+    dept_group = np.select(
+        [dept.str.contains(DEPT_SX1, regex=False), dept.str.contains(DEPT_SX2, regex=False)],
+        [1, 2],
+        default=0
+    )
+
+    return pd.DataFrame({
+        'day': df_phtcv['date_parsed'].dt.normalize(),
+        'machine': machine,
+        'machine_exact': machine_raw == machine,
+        'dept': dept,
+        'dept_group': dept_group,
+        'row_total_time': row_total_time,
+        'dung': dung,
+        'dung_khac': dung_khac,
+        'tgcb': tgcb,
+        'chay_thu': chay_thu,
+        'ga_lap': ga_lap,
+        'gia_cong': gia_cong,
+    }, index=df_phtcv.index)
+
+
+@traced(rows_arg='df_phtcv', sheet='PHTCV')
+def calculate_production_capacity_range(
+    df_phtcv: pd.DataFrame,
+    df_gckt: pd.DataFrame,
+    gckt_times: pd.DataFrame,
+    df_machine_list: pd.DataFrame,
+    start_date,
+    end_date,
+    phtcv_times: pd.DataFrame = None
+) -> pd.DataFrame:
+    """
+    Sản xuất AMJ KPIs for every day of [start_date, end_date] in one pass
+
+    Same rules as the per-day dashboard loop:
+    - B (máy 12h) = machines with >= 620 phút in at least one department
+    - Thời gian máy chạy = master × 20h if B >= 95% of PHTCV machines,
+      else (master - B) × 14h + B × 20h
+    - Máy dừng (per Sản xuất 1 / 2) = master machines absent from PHTCV that day,
+      plus machines with dừng / dừng khác >= 420 and no tgcb / chạy thử / gá lắp / gia công
+    - CS tổng = thời gian gia công / thời gian máy chạy
+    - CS trực tiếp = thời gian gia công / (thời gian máy chạy - máy dừng × 7h)
+
+    Only days having both PHTCV rows and GCKT deliveries are returned.
+
+    Args:
+        df_phtcv: PHTCV rows (with 'date_parsed'), may cover more than the range
+        df_gckt: GCKT_GPKT rows (with 'ngay_giao_parsed')
+        gckt_times: Result of calculate_gckt_processing_times for df_gckt
+        df_machine_list: machine_list sheet
+        start_date, end_date: Inclusive date range
+        phtcv_times: Optional precomputed prepare_phtcv_machine_times(df_phtcv)
+
+    Returns:
+        DataFrame with PRODUCTION_CAPACITY_RANGE_COLUMNS, one row per day
+    """
+    empty = pd.DataFrame(columns=PRODUCTION_CAPACITY_RANGE_COLUMNS)
+    if df_phtcv is None or df_phtcv.empty or gckt_times is None:
+        return empty
+
+    start_day = pd.Timestamp(start_date).normalize()
+    end_day = pd.Timestamp(end_date).normalize()
+
+    # Daily GCKT totals (thời gian gia công, sản lượng)
+    gckt_days = df_gckt['ngay_giao_parsed'].dt.normalize()
+    gckt_in_range = (gckt_days >= start_day) & (gckt_days <= end_day)
+    gckt_daily = gckt_times[gckt_in_range].groupby(gckt_days[gckt_in_range]).agg(
+        tong_thoi_gian_gia_cong=('total_time', 'sum'),
+        san_luong=('sl_giao_numeric', 'sum')
+    )
+
+    # PHTCV rows of the range
+    if phtcv_times is None:
+        phtcv_times = prepare_phtcv_machine_times(df_phtcv)
+    rows = phtcv_times[(phtcv_times['day'] >= start_day) & (phtcv_times['day'] <= end_day)]
+
+    days = pd.DatetimeIndex(sorted(set(rows['day'].dropna()) & set(gckt_daily.index)), name='date')
+    if len(days) == 0:
+        return empty
+    rows = rows[rows['day'].isin(days)]
+
+    return _capacity_by_day(rows, gckt_daily, days, df_machine_list)[PRODUCTION_CAPACITY_RANGE_COLUMNS]
+
+
+def _capacity_by_day(rows: pd.DataFrame, gckt_daily: pd.DataFrame, days: pd.DatetimeIndex,
+                     df_machine_list: pd.DataFrame) -> pd.DataFrame:
+    """
+    Capacity rules applied to every 'day' bucket of prepared PHTCV rows
+
+    Args:
+        rows: prepare_phtcv_machine_times rows whose 'day' is in days
+        gckt_daily: tong_thoi_gian_gia_cong / san_luong indexed by day
+        days: Buckets to report (DatetimeIndex named 'date')
+
+    Returns:
+        PRODUCTION_CAPACITY_RANGE_COLUMNS + 'may_trong_phtcv' (distinct PHTCV machines)
+        and 'tong_may_master'
+    """
+    machine_rows = rows[rows['machine'] != '']
+
+    # B: machines >= 620 phút in at least one department
+    pair_time = machine_rows.groupby(['day', 'machine', 'dept'])['row_total_time'].sum()
+    machine_is_12h = (pair_time >= MACHINE_12H_MINUTES).groupby(level=['day', 'machine']).any()
+    may_12h = machine_is_12h.groupby(level='day').sum().reindex(days, fill_value=0)
+    machines_in_phtcv = machine_is_12h.groupby(level='day').size().reindex(days, fill_value=0)
+
+    total_machines_master, master_machines = get_master_machines(df_machine_list)
+
+    all_12h = (machines_in_phtcv > 0) & (may_12h / machines_in_phtcv.where(machines_in_phtcv > 0, 1) >= ALL_12H_RATIO)
+    may_8h = (total_machines_master - may_12h).where(~all_12h, 0)
+    thoi_gian_may_chay = pd.Series(
+        np.where(
+            all_12h,
+            total_machines_master * SHIFT_12H_MINUTES,
+            (total_machines_master - may_12h) * SHIFT_8H_MINUTES + may_12h * SHIFT_12H_MINUTES
+        ),
+        index=days
+    )
+
+    # Máy dừng, condition 1: master machines not in PHTCV (per Sản xuất 1 / 2)
+    dept_rows = machine_rows[machine_rows['dept_group'] > 0]
+    dept_machines = dept_rows[['day', 'dept_group', 'machine']].drop_duplicates()
+    master_present = dept_machines['machine'].isin(master_machines).groupby(dept_machines['day']).sum()
+    not_in_phtcv = 2 * len(master_machines) - master_present.reindex(days, fill_value=0)
+
+    # Máy dừng, condition 2 AND 3: whole-shift stop and no production
+    exact_rows = dept_rows[dept_rows['machine_exact']]
+    per_machine = exact_rows.groupby(['day', 'dept_group', 'machine']).agg(
+        dung=('dung', 'max'), dung_khac=('dung_khac', 'max'),
+        tgcb=('tgcb', 'sum'), chay_thu=('chay_thu', 'sum'),
+        ga_lap=('ga_lap', 'sum'), gia_cong=('gia_cong', 'sum')
+    )
+    is_stopped = (
+        ((per_machine['dung'] >= STOPPED_MIN_STOP_MINUTES) | (per_machine['dung_khac'] >= STOPPED_MIN_STOP_MINUTES)) &
+        (per_machine['tgcb'] == 0) & (per_machine['chay_thu'] == 0) &
+        (per_machine['ga_lap'] == 0) & (per_machine['gia_cong'] == 0)
+    )
+    stopped_in_phtcv = is_stopped.groupby(level='day').sum().reindex(days, fill_value=0)
+
+    may_dung = not_in_phtcv + stopped_in_phtcv
+    thoi_gian_may_dung = may_dung * STOPPED_MACHINE_MINUTES
+    thoi_gian_truc_tiep = thoi_gian_may_chay - thoi_gian_may_dung
+
+    tong_thoi_gian_gia_cong = gckt_daily['tong_thoi_gian_gia_cong'].reindex(days)
+
+    result = pd.DataFrame({
+        'date': days,
+        'san_luong': gckt_daily['san_luong'].reindex(days).astype(int).to_numpy(),
+        'tong_thoi_gian_gia_cong': tong_thoi_gian_gia_cong.to_numpy(),
+        'may_12h': may_12h.to_numpy(),
+        'may_8h': may_8h.to_numpy(),
+        'may_dung': may_dung.to_numpy(),
+        'thoi_gian_may_chay': thoi_gian_may_chay.to_numpy(),
+        'thoi_gian_may_dung': thoi_gian_may_dung.to_numpy(),
+        'may_trong_phtcv': machines_in_phtcv.to_numpy(),
+        'tong_may_master': total_machines_master,
+    })
+    result['cs_tong'] = np.where(
+        result['thoi_gian_may_chay'] > 0,
+        result['tong_thoi_gian_gia_cong'] / result['thoi_gian_may_chay'].where(result['thoi_gian_may_chay'] > 0, 1) * 100,
+        0
+    )
+    thoi_gian_truc_tiep = thoi_gian_truc_tiep.to_numpy()
+    result['cs_truc_tiep'] = np.where(
+        thoi_gian_truc_tiep > 0,
+        result['tong_thoi_gian_gia_cong'] / np.where(thoi_gian_truc_tiep > 0, thoi_gian_truc_tiep, 1) * 100,
+        0
+    )
+    return result
+
+
+@traced(rows_arg='phtcv_times', sheet='PHTCV')
+def calculate_production_capacity_period(
+    gckt_times: pd.DataFrame,
+    df_machine_list: pd.DataFrame,
+    phtcv_times: pd.DataFrame
+) -> dict:
+    """
+    Sản xuất AMJ KPIs of a set of rows taken as ONE period
+
+    Used for a single day and for the unfiltered dashboard view ('Tất cả'),
+    where every PHTCV row / GCKT delivery given is summed as one bucket.
+    Same rules as calculate_production_capacity_range.
+
+    Args:
+        gckt_times: calculate_gckt_processing_times rows of the period
+        df_machine_list: machine_list sheet
+        phtcv_times: prepare_phtcv_machine_times rows of the period
+
+    Returns:
+        dict with the PRODUCTION_CAPACITY_RANGE_COLUMNS values (except 'date'),
+        'may_trong_phtcv', 'tong_may_master' and 'machines_12h_details'
+        (DataFrame: machine, dept, total_time - department with the highest time)
+    """
+    bucket = pd.Timestamp(0)
+    days = pd.DatetimeIndex([bucket], name='date')
+    gckt_daily = pd.DataFrame({
+        'tong_thoi_gian_gia_cong': [gckt_times['total_time'].sum()],
+        'san_luong': [gckt_times['sl_giao_numeric'].sum()],
+    }, index=days)
+
+    rows = phtcv_times.assign(day=bucket)
+    result = _capacity_by_day(rows, gckt_daily, days, df_machine_list).iloc[0].drop('date').to_dict()
+
+    # Máy 12h details: per machine, the department with the highest time (first seen on ties)
+    machine_rows = rows[rows['machine'] != '']
+    pair_time = machine_rows.groupby(['machine', 'dept'], sort=False)['row_total_time'].sum().reset_index()
+    pair_time = pair_time[pair_time['row_total_time'] >= MACHINE_12H_MINUTES]
+    best = pair_time.loc[pair_time.groupby('machine', sort=False)['row_total_time'].idxmax()]
+    result['machines_12h_details'] = best.rename(columns={'row_total_time': 'total_time'}).reset_index(drop=True)
+    return result
+
+
+def classify_machines_by_department(phtcv_times: pd.DataFrame, df_machine_list: pd.DataFrame) -> dict:
+    """
+    Máy 12h / 8h / dừng of every master machine, per Sản xuất 1 / 2 (one day)
+
+    - dừng: not in PHTCV, or max(dừng + dừng khác) >= 420 with no tgcb / chạy thử / gá lắp / gia công
+    - 12h: total time >= 620 phút, otherwise 8h
+
+    Args:
+        phtcv_times: prepare_phtcv_machine_times rows of the day
+        df_machine_list: machine_list sheet (machines are listed in its order)
+
+    Returns:
+        {DEPT_SX1: {'may_12h': [...], 'may_8h': [...], 'may_dung': [...]}, DEPT_SX2: {...}}
+    """
+    if df_machine_list is not None and 'số máy' in df_machine_list.columns:
+        master = df_machine_list['số máy'].astype(str).str.strip()
+        master = master[master != ''].reset_index(drop=True)
+    else:
+        master = pd.Series([], dtype=str)
+
+    machine_rows = phtcv_times[phtcv_times['machine'] != '']
+    production_columns = ['tgcb', 'chay_thu', 'ga_lap', 'gia_cong']
+
+    result = {}
+    for dept_group, dept_name in ((1, DEPT_SX1), (2, DEPT_SX2)):
+        group_rows = machine_rows[machine_rows['dept_group'] == dept_group]
+        machine_time = group_rows.groupby('machine')['row_total_time'].sum()
+        machine_stop = (group_rows['dung'] + group_rows['dung_khac']).groupby(group_rows['machine']).max()
+        exact_rows = group_rows[group_rows['machine_exact']]
+        has_production = (exact_rows.groupby('machine')[production_columns].sum() > 0).any(axis=1)
+
+        total_time = master.map(machine_time)
+        stop_time = master.map(machine_stop)
+        produced = master.map(has_production).fillna(False).astype(bool)
+
+        stopped = total_time.isna() | ((stop_time >= STOPPED_MIN_STOP_MINUTES) & ~produced)
+        is_12h = ~stopped & (total_time >= MACHINE_12H_MINUTES)
+        result[dept_name] = {
+            'may_12h': master[is_12h].tolist(),
+            'may_8h': master[~stopped & ~is_12h].tolist(),
+            'may_dung': master[stopped].tolist(),
+        }
+    return result
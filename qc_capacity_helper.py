@@ -4,12 +4,158 @@ Helper functions for Quality Control Capacity Calculation
 """
 
 import pandas as pd
-import math
+import numpy as np
 import logging
 
+from date_parsing import parse_dates
+from span_log import traced
+
 logger = logging.getLogger(__name__)
 
+# Mã công việc PKT (phụ thuộc sll theo 3 nhánh)
+PKT_CODES = ['IKTBV', 'IKTHD', 'IKMBV', 'IKMHD']
+# 9 mã công việc khác (nhân trực tiếp với sll)
+OTHER_CODES = ['ITNBM', 'ITTBS', 'IVNBM', 'IVTBS', 'IRNBM', 'IRNXS', 'IRLSP', 'IDLSS', 'IDDGS']
+# Mã IXXLT và IXXLM (nhân trực tiếp với sll)
+IXX_CODES = ['IXXLT', 'IXXLM']
+
+# Column order of the standard time matrix used by the vectorized kernel
+QC_TIME_CODES = PKT_CODES + OTHER_CODES + IXX_CODES
+
+# Bộ phận Kiểm tra trong __HR_SYSTEM__Daily Head Counts
+QC_DEPARTMENT_ID = '0300_BPKT'
+
+# HR head count columns -> result keys
+HR_HEAD_COUNT_COLUMNS = {
+    'Tong So Nguoi Lam Them Gio 12h': 'A_tong',
+    'Tong So Nguoi Lam Them Gio 12h Truc Tiep': 'A_truc_tiep',
+    'Tong So Nguoi Lam Them Gio 8h': 'B_tong',
+    'Tong So Nguoi Lam Them Gio 8h Truc Tiep': 'B_truc_tiep',
+}
+HR_HEAD_COUNT_INDEX = ['Department ID', 'Working Date']
+
+QC_CAPACITY_RANGE_COLUMNS = [
+    'date', 'cs_tong', 'cs_truc_tiep', 'A_tong', 'A_truc_tiep', 'B_tong',
+    'practical_employees_count', 'thoi_gian_100_nguoi', 'thoi_gian_nguoi_truc_tiep',
+    'total_completion_time', 'san_luong'
+]
+
+
+def build_qc_standard_time_table(df_thoi_gian_hoan_thanh):
+    """
+    Build the per-part standard time table from thoi_gian_hoan_thanh
+    
+    Keeps the first Thoi_Gian found for each (ten_chi_tiet, ma_cv) pair,
+    exactly like the old row-by-row lookup. Missing or invalid times are 0.
+    
+    Returns:
+        DataFrame indexed by ten_chi_tiet with one float column per code in QC_TIME_CODES
+    """
+    if df_thoi_gian_hoan_thanh is None or df_thoi_gian_hoan_thanh.empty:
+        return pd.DataFrame(columns=QC_TIME_CODES, dtype=float)
+    
+    df_times = df_thoi_gian_hoan_thanh[['ten_chi_tiet', 'ma_cv', 'Thoi_Gian']]
+    df_times = df_times[df_times['ma_cv'].isin(QC_TIME_CODES)]
+    
+    # Parts without any known code must still be present (they contribute 0, not skipped)
+    all_parts = pd.Index(df_thoi_gian_hoan_thanh['ten_chi_tiet'].unique())
+    
+    df_times = df_times.drop_duplicates(subset=['ten_chi_tiet', 'ma_cv'], keep='first')
+    thoi_gian = pd.to_numeric(
+        df_times['Thoi_Gian'].astype(str).str.strip().str.replace(',', '.'),
+        errors='coerce'
+    ).fillna(0.0)
+    
+    table = (
+        df_times.assign(Thoi_Gian=thoi_gian)
+        .pivot(index='ten_chi_tiet', columns='ma_cv', values='Thoi_Gian')
+        .reindex(index=all_parts, columns=QC_TIME_CODES)
+        .fillna(0.0)
+        .astype(float)
+    )
+    table.index.name = 'ten_chi_tiet'
+    return table
+
 
+def calculate_qc_completion_times(sll, standard_times):
+    """
+    Vectorized QC completion time kernel
+    
+    Args:
+        sll: 1-D array of quantities (one per delivery row)
+        standard_times: 2-D array of shape (len(sll), len(QC_TIME_CODES)),
+            columns ordered as QC_TIME_CODES
+    
+    Returns:
+        np.ndarray: completion time (minutes) for each row
+    """
+    sll = np.asarray(sll, dtype=float)
+    times = np.asarray(standard_times, dtype=float).reshape(len(sll), len(QC_TIME_CODES))
+    
+    IKTBV, IKTHD, IKMBV, IKMHD = (times[:, i] for i in range(len(PKT_CODES)))
+    
+    # PKT time by sll branch: sll <= 2, 2 < sll <= 10, sll > 10
+    pkt_time = np.select(
+        [sll <= 2, sll <= 10],
+        [
+            sll * IKTBV + sll * IKMBV,
+            2 * IKTBV + (sll - 2) * IKTHD + IKMBV + (sll - 2) * IKMHD,
+        ],
+        default=1 * IKTBV + (sll - 1) * IKTHD + IKMBV + (sll - 1) * IKMHD
+    )
+    
+    # Other groups: (ITNBM + ITTBS + ... + IDDGS) × sll
+    # Summed left to right so results match the scalar formula bit for bit
+    offset = len(PKT_CODES)
+    total_other_time = np.zeros(len(sll))
+    for i in range(offset, offset + len(OTHER_CODES)):
+        total_other_time = total_other_time + times[:, i]
+    other_time = total_other_time * sll
+    
+    # (sll × IXXLT) + (sll × IXXLM)
+    offset += len(OTHER_CODES)
+    ixlt_ixlm_time = sll * times[:, offset] + sll * times[:, offset + 1]
+    
+    return pkt_time + other_time + ixlt_ixlm_time
+
+
+def calculate_completion_times_for_deliveries(df_giao_kho, standard_times):
+    """
+    Per-row completion times for giao_kho_vp deliveries
+    
+    Rows with invalid/non-finite sll or with a ten_chi_tiet missing from
+    standard_times get NaN (they are skipped by the totals).
+    
+    Args:
+        df_giao_kho: giao_kho_vp rows (needs 'ten_chi_tiet' and 'sll')
+        standard_times: table from build_qc_standard_time_table
+    
+    Returns:
+        pd.Series aligned with df_giao_kho.index
+    """
+    result = pd.Series(np.nan, index=df_giao_kho.index, dtype=float)
+    if df_giao_kho.empty or 'sll' not in df_giao_kho.columns or standard_times.empty:
+        return result
+    
+    sll = pd.to_numeric(
+        df_giao_kho['sll'].astype(str).str.strip().str.replace(',', '.'),
+        errors='coerce'
+    ).to_numpy(dtype=float)
+    part_idx = standard_times.index.get_indexer(df_giao_kho['ten_chi_tiet'])
+    valid = np.isfinite(sll) & (part_idx >= 0)
+    
+    if valid.any():
+        times = standard_times.to_numpy(dtype=float)[part_idx[valid]]
+        result.iloc[np.flatnonzero(valid)] = calculate_qc_completion_times(sll[valid], times)
+    return result
+
+
+def calculate_total_completion_time(df_giao_kho, standard_times):
+    """Total completion time (minutes) of a set of giao_kho_vp deliveries"""
+    return float(calculate_completion_times_for_deliveries(df_giao_kho, standard_times).sum())
+
+
+@traced(rows_arg='df_giao_kho_filtered', sheet='giao_kho_vp')
 def calculate_quality_control_capacity(
     df_giao_kho_filtered,
     df_shift_schedule,
@@ -61,129 +207,23 @@ def calculate_quality_control_capacity(
     # ============= Calculate A for CS Tổng and CS Trực Tiếp =============
     # tong_sl_nsu_dangky_lam_12h: Total 12h workers (for CS Tổng)
     # tong_sl_nsu_tructiep_lam_12h: Direct 12h workers only (for CS Trực Tiếp)
+    head_count_table = build_hr_head_count_table(df_hr_daily_head_counts)
+    head_counts = get_head_counts(head_count_table, test_date_parsed)
+    has_head_counts = head_counts is not None
+    if not has_head_counts:
+        head_counts = dict.fromkeys(HR_HEAD_COUNT_COLUMNS.values(), 0)
     
-    tong_sl_nsu_dangky_lam_12h = 0
-    tong_sl_nsu_tructiep_lam_12h = 0
-    
-    # To-Do: do the same with these following columns:
-    tong_sl_nsu_dangky_lam_8h = 0
-    tong_sl_nsu_tructiep_lam_8h = 0
-    
-    df_hr_filtered = df_hr_daily_head_counts[
-        (df_hr_daily_head_counts['Department ID'] == '0300_BPKT') &
-        (df_hr_daily_head_counts['Working Date Parsed'] == test_date_parsed)
-    ].copy()
-    
-    if len(df_hr_filtered) > 0:
-        # Get tong_sl_nsu_dangky_lam_12h from "Tong So Nguoi Lam Them Gio 12h" (total 12h workers)
-        if 'Tong So Nguoi Lam Them Gio 12h' in df_hr_filtered.columns:
-            tong_sl_nsu_dangky_lam_12h_str = str(df_hr_filtered['Tong So Nguoi Lam Them Gio 12h'].iloc[0]).strip()
-            if tong_sl_nsu_dangky_lam_12h_str and tong_sl_nsu_dangky_lam_12h_str != '' and tong_sl_nsu_dangky_lam_12h_str != 'nan':
-                try:
-                    tong_sl_nsu_dangky_lam_12h = int(float(tong_sl_nsu_dangky_lam_12h_str.replace(',', '.')))
-                except (ValueError, TypeError):
-                    logger.debug("Invalid number for Tong So Nguoi Lam Them Gio 12h: %r", tong_sl_nsu_dangky_lam_12h_str)
-                    tong_sl_nsu_dangky_lam_12h = 0
-        
-        # Get tong_sl_nsu_tructiep_lam_12h from "Tong So Nguoi Lam Them Gio 12h Truc Tiep" (direct 12h workers)
-        if 'Tong So Nguoi Lam Them Gio 12h Truc Tiep' in df_hr_filtered.columns:
-            tong_sl_nsu_tructiep_lam_12h_str = str(df_hr_filtered['Tong So Nguoi Lam Them Gio 12h Truc Tiep'].iloc[0]).strip()
-            if tong_sl_nsu_tructiep_lam_12h_str and tong_sl_nsu_tructiep_lam_12h_str != '' and tong_sl_nsu_tructiep_lam_12h_str != 'nan':
-                try:
-                    tong_sl_nsu_tructiep_lam_12h = int(float(tong_sl_nsu_tructiep_lam_12h_str.replace(',', '.')))
-                except (ValueError, TypeError):
-                    logger.debug("Invalid number for Tong So Nguoi Lam Them Gio 12h Truc Tiep: %r", tong_sl_nsu_tructiep_lam_12h_str)
-                    tong_sl_nsu_tructiep_lam_12h = 0
-                    
-        if 'Tong So Nguoi Lam Them Gio 8h' in df_hr_filtered.columns:
-            tong_sl_nsu_dangky_lam_8h_str = str(df_hr_filtered['Tong So Nguoi Lam Them Gio 8h'].iloc[0]).strip()
-            if tong_sl_nsu_dangky_lam_8h_str and tong_sl_nsu_dangky_lam_8h_str != '' and tong_sl_nsu_dangky_lam_8h_str != 'nan':
-                try:
-                    tong_sl_nsu_dangky_lam_8h = int(float(tong_sl_nsu_dangky_lam_8h_str.replace(',', '.')))
-                except (ValueError, TypeError):
-                    logger.debug("Invalid number for Tong So Nguoi Lam Them Gio 8h: %r", tong_sl_nsu_dangky_lam_8h_str)
-                    tong_sl_nsu_dangky_lam_8h = 0
-                    
-        if 'Tong So Nguoi Lam Them Gio 8h Truc Tiep' in df_hr_filtered.columns:
-            tong_sl_nsu_tructiep_lam_8h_str = str(df_hr_filtered['Tong So Nguoi Lam Them Gio 8h Truc Tiep'].iloc[0]).strip()
-            if tong_sl_nsu_tructiep_lam_8h_str and tong_sl_nsu_tructiep_lam_8h_str != '' and tong_sl_nsu_tructiep_lam_8h_str != 'nan':
-                try:
-                    tong_sl_nsu_tructiep_lam_8h = int(float(tong_sl_nsu_tructiep_lam_8h_str.replace(',', '.')))
-                except (ValueError, TypeError):
-                    logger.debug("Invalid number for Tong So Nguoi Lam Them Gio 8h Truc Tiep: %r", tong_sl_nsu_tructiep_lam_8h_str)
-                    tong_sl_nsu_tructiep_lam_8h = 0
+    tong_sl_nsu_dangky_lam_12h = head_counts['A_tong']
+    tong_sl_nsu_tructiep_lam_12h = head_counts['A_truc_tiep']
+    tong_sl_nsu_dangky_lam_8h = head_counts['B_tong']
+    tong_sl_nsu_tructiep_lam_8h = head_counts['B_truc_tiep']
     
     # ============= Calculate 100-person time (for CS Tổng) =============
     tong_thoi_gian_nang_luc_du_kien = (tong_sl_nsu_dangky_lam_12h * 10 * 60) + (tong_sl_nsu_dangky_lam_8h * 6.5 * 60)
     
     # ============= Calculate total completion time =============
-    total_completion_time = 0
-    
-    for _, row in df_giao_kho_filtered.iterrows():
-        ten_chi_tiet = row['ten_chi_tiet']
-        sll_str = str(row.get('sll', '')).replace(',', '.')
-        try:
-            sll = float(sll_str)
-        except (ValueError, TypeError):
-            logger.debug("Skipping row with invalid sll=%r for ten_chi_tiet=%r", sll_str, row.get('ten_chi_tiet'))
-            continue
-        if not math.isfinite(sll):
-            logger.debug("Skipping row with non-finite sll=%r for ten_chi_tiet=%r", sll, row.get('ten_chi_tiet'))
-            continue
-        
-        # Find matching time data
-        df_time_match = df_thoi_gian_hoan_thanh[
-            df_thoi_gian_hoan_thanh['ten_chi_tiet'] == ten_chi_tiet
-        ].copy()
-        
-        if len(df_time_match) == 0:
-            continue
-        
-        # Extract PKT codes
-        def get_time_value(code):
-            subset = df_time_match[df_time_match['ma_cv'] == code]['Thoi_Gian']
-            if subset.empty:
-                return 0.0
-            val = subset.iloc[0]
-            try:
-                return float(str(val).replace(',', '.'))
-            except (ValueError, TypeError):
-                logger.debug("Invalid Thoi_Gian for code=%s ten_chi_tiet=%s: %r", code, ten_chi_tiet, val)
-                return 0.0
-        
-        # Extract PKT codes
-        IKTBV = get_time_value('IKTBV')
-        IKTHD = get_time_value('IKTHD')
-        IKMBV = get_time_value('IKMBV')
-        IKMHD = get_time_value('IKMHD')
-        
-        # Extract other codes (9 codes total)
-        other_codes = ['ITNBM', 'ITTBS', 'IVNBM', 'IVTBS', 'IRNBM', 'IRNXS', 'IRLSP', 'IDLSS', 'IDDGS']
-        total_other_time = sum(get_time_value(code) for code in other_codes)
-        
-        # Extract IXXLT and IXXLM codes
-        IXXLT = get_time_value('IXXLT')
-        IXXLM = get_time_value('IXXLM')
-        
-        # Calculate PKT time based on sll conditions
-        if sll <= 2:
-            pkt_time = sll * IKTBV + sll * IKMBV
-        elif sll <= 10:  # Changed: 2 < sll <= 10
-            pkt_time = 2 * IKTBV + (sll - 2) * IKTHD + IKMBV + (sll - 2) * IKMHD
-        else:  # sll > 10 (Changed from >= 10)
-            pkt_time = 1 * IKTBV + (sll - 1) * IKTHD + IKMBV + (sll - 1) * IKMHD
-        
-        # Calculate other groups time
-        # Formula: (ITNBM + ITTBS + IVNBM + IVTBS + IRNBM + IRNXS + IRLSP + IDLSS + IDDGS) × sll
-        other_time = total_other_time * sll
-        
-        # Calculate IXXLT and IXXLM time
-        # Formula: (sll × IXXLT) + (sll × IXXLM)
-        ixlt_ixlm_time = sll * IXXLT + sll * IXXLM
-        
-        # Total time = PKT time + Other time + IXXLT/IXXLM time
-        time = pkt_time + other_time + ixlt_ixlm_time
-        total_completion_time += time
+    standard_times = build_qc_standard_time_table(df_thoi_gian_hoan_thanh)
+    total_completion_time = calculate_total_completion_time(df_giao_kho_filtered, standard_times)
     
     # ============= Calculate CS Tổng =============
     if tong_thoi_gian_nang_luc_du_kien > 0:
@@ -196,7 +236,7 @@ def calculate_quality_control_capacity(
     cs_truc_tiep = 0
     thoi_gian_nguoi_truc_tiep = 0
     
-    if len(df_hr_filtered) > 0:
+    if has_head_counts:
         # Calculate direct worker time
         # = (Practical Employees - tong_sl_nsu_tructiep_lam_12h) × 6.5 × 60 + tong_sl_nsu_tructiep_lam_12h × 10 × 60
         thoi_gian_nguoi_truc_tiep = (tong_sl_nsu_tructiep_lam_8h) * 6.5 * 60 + tong_sl_nsu_tructiep_lam_12h * 10 * 60
@@ -218,3 +258,182 @@ def calculate_quality_control_capacity(
     }
     
     return result
+
+
+def _parse_head_counts(values):
+    """Parse head count strings ('12', '7,0', '', 'nan') to int, invalid -> 0"""
+    numbers = pd.to_numeric(
+        values.astype(str).str.strip().str.replace(',', '.'),
+        errors='coerce'
+    )
+    invalid = ~np.isfinite(numbers)
+    if invalid.any():
+        logger.debug("Invalid head counts treated as 0: %d value(s)", int(invalid.sum()))
+    numbers = numbers.where(~invalid, 0.0)
+    return np.trunc(numbers).astype(int)
+
+
+def build_hr_head_count_table(df_hr_daily_head_counts):
+    """
+    Pre-parse __HR_SYSTEM__Daily Head Counts into a numeric lookup table
+    
+    Head count strings are parsed once (invalid -> 0) and only the first row
+    of each (Department ID, Working Date) is kept, like the old per-call
+    .iloc[0] lookup. A table that is already built is returned unchanged.
+    
+    Returns:
+        DataFrame with a sorted (Department ID, Working Date) MultiIndex and
+        int columns A_tong, A_truc_tiep, B_tong, B_truc_tiep
+    """
+    if df_hr_daily_head_counts is None:
+        return None
+    if list(df_hr_daily_head_counts.index.names) == HR_HEAD_COUNT_INDEX:
+        return df_hr_daily_head_counts
+    
+    if 'Working Date Parsed' in df_hr_daily_head_counts.columns:
+        working_dates = df_hr_daily_head_counts['Working Date Parsed']
+    else:
+        working_dates = parse_dates(df_hr_daily_head_counts['Working Date'], format='%d/%m/%Y')
+    
+    valid = working_dates.notna()
+    df_hr = df_hr_daily_head_counts[valid]
+    
+    table = pd.DataFrame(index=pd.MultiIndex.from_arrays(
+        [df_hr['Department ID'].astype(str).to_numpy(), pd.DatetimeIndex(working_dates[valid])],
+        names=HR_HEAD_COUNT_INDEX
+    ))
+    for column, key in HR_HEAD_COUNT_COLUMNS.items():
+        if column in df_hr.columns:
+            table[key] = _parse_head_counts(df_hr[column]).to_numpy()
+        else:
+            table[key] = 0
+    
+    table = table[~table.index.duplicated(keep='first')]
+    return table.sort_index()
+
+
+def get_head_counts(head_count_table, date, department_id=QC_DEPARTMENT_ID):
+    """
+    Head counts of one department on one day
+    
+    Returns:
+        dict with A_tong, A_truc_tiep, B_tong, B_truc_tiep, or None if the day has no HR row
+    """
+    if head_count_table is None or head_count_table.empty:
+        return None
+    try:
+        row = head_count_table.loc[(department_id, pd.Timestamp(date))]
+    except KeyError:
+        return None
+    return {key: int(value) for key, value in row.items()}
+
+
+def get_head_counts_range(head_count_table, start_date, end_date, department_id=QC_DEPARTMENT_ID):
+    """
+    Head counts of one department for every HR day in [start_date, end_date]
+    
+    Returns:
+        DataFrame indexed by date with columns A_tong, A_truc_tiep, B_tong, B_truc_tiep
+    """
+    columns = list(HR_HEAD_COUNT_COLUMNS.values())
+    if head_count_table is None or head_count_table.empty:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='date'))
+    
+    start_day = pd.Timestamp(start_date).normalize()
+    end_day = pd.Timestamp(end_date).normalize()
+    head_counts = head_count_table.loc[(department_id, start_day):(department_id, end_day)]
+    head_counts = head_counts.droplevel('Department ID')
+    head_counts.index.name = 'date'
+    return head_counts
+
+
+@traced(rows_arg='df_giao_kho_vp', sheet='giao_kho_vp')
+def calculate_quality_control_capacity_range(
+    df_giao_kho_vp,
+    df_shift_schedule,
+    df_hr_daily_head_counts,
+    df_thoi_gian_hoan_thanh,
+    start_date,
+    end_date
+):
+    """
+    Tính toán Công Suất Kiểm Tra cho mọi ngày trong khoảng [start_date, end_date]
+    
+    Same formulas as calculate_quality_control_capacity, but deliveries are
+    grouped by ngay_dong_goi and HR head counts are joined by date once,
+    instead of one call per day.
+    
+    Args:
+        df_giao_kho_vp: giao_kho_vp rows (unfiltered, needs ngay_dong_goi)
+        start_date, end_date: anything accepted by pd.Timestamp (inclusive, by day)
+    
+    Returns:
+        DataFrame with one row per day that has deliveries, columns QC_CAPACITY_RANGE_COLUMNS
+    """
+    empty = pd.DataFrame(columns=QC_CAPACITY_RANGE_COLUMNS)
+    
+    if df_giao_kho_vp is None or df_giao_kho_vp.empty:
+        return empty
+    
+    # Like the single-day function, missing inputs give 0 capacity (sản lượng is still reported)
+    can_calculate = not (
+        df_shift_schedule is None or df_shift_schedule.empty or
+        df_hr_daily_head_counts is None or df_hr_daily_head_counts.empty or
+        df_thoi_gian_hoan_thanh is None or df_thoi_gian_hoan_thanh.empty
+    )
+    
+    if 'ngay_dong_goi_parsed' in df_giao_kho_vp.columns:
+        delivery_dates = df_giao_kho_vp['ngay_dong_goi_parsed']
+    else:
+        delivery_dates = parse_dates(df_giao_kho_vp['ngay_dong_goi'], format='%d/%m/%Y')
+    delivery_days = delivery_dates.dt.normalize()
+    
+    start_day = pd.Timestamp(start_date).normalize()
+    end_day = pd.Timestamp(end_date).normalize()
+    in_range = (delivery_days >= start_day) & (delivery_days <= end_day)
+    if not in_range.any():
+        return empty
+    
+    df_range = df_giao_kho_vp[in_range]
+    days = delivery_days[in_range]
+    
+    # ============= Completion time and sản lượng per day =============
+    if can_calculate:
+        standard_times = build_qc_standard_time_table(df_thoi_gian_hoan_thanh)
+        completion_times = calculate_completion_times_for_deliveries(df_range, standard_times)
+    else:
+        completion_times = pd.Series(0.0, index=df_range.index)
+    
+    if 'sll' in df_range.columns:
+        san_luong = pd.to_numeric(
+            df_range['sll'].astype(str).str.replace(',', '.'),
+            errors='coerce'
+        ).fillna(0)
+    else:
+        san_luong = pd.Series(0.0, index=df_range.index)
+    
+    daily = pd.DataFrame({
+        'total_completion_time': completion_times.fillna(0.0).to_numpy(),
+        'san_luong': san_luong.to_numpy(),
+    }, index=pd.DatetimeIndex(days, name='date')).groupby(level='date').sum()
+    daily['san_luong'] = daily['san_luong'].astype(int)
+    
+    # ============= Join HR head counts once =============
+    if can_calculate:
+        head_count_table = build_hr_head_count_table(df_hr_daily_head_counts)
+        head_counts = get_head_counts_range(head_count_table, start_day, end_day)
+        daily = daily.join(head_counts, how='left')
+    for key in HR_HEAD_COUNT_COLUMNS.values():
+        daily[key] = daily[key].fillna(0).astype(int) if key in daily.columns else 0
+    
+    # ============= CS Tổng / CS Trực Tiếp =============
+    daily['thoi_gian_100_nguoi'] = (daily['A_tong'] * 10 * 60) + (daily['B_tong'] * 6.5 * 60)
+    daily['thoi_gian_nguoi_truc_tiep'] = (daily['B_truc_tiep']) * 6.5 * 60 + daily['A_truc_tiep'] * 10 * 60
+    daily['practical_employees_count'] = daily['B_truc_tiep'] + daily['A_truc_tiep']
+    
+    thoi_gian_100_nguoi = daily['thoi_gian_100_nguoi']
+    daily['cs_tong'] = (daily['total_completion_time'] / thoi_gian_100_nguoi.where(thoi_gian_100_nguoi > 0) * 100).fillna(0)
+    thoi_gian_truc_tiep = daily['thoi_gian_nguoi_truc_tiep']
+    daily['cs_truc_tiep'] = (daily['total_completion_time'] / thoi_gian_truc_tiep.where(thoi_gian_truc_tiep > 0) * 100).fillna(0)
+    
+    return daily.reset_index()[QC_CAPACITY_RANGE_COLUMNS]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Quota Budget
+Sheets API calls per credential in a sliding 60 s window, paced under the quota
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+
+
+# Sheets API read quota: 60 requests / minute / user (a service account is one user)
+SHEETS_READ_REQUESTS_PER_MINUTE = 60
+QUOTA_WINDOW_SECONDS = 60
+
+# Share of the window kept for urgent fetches: below it, non-urgent fetches are deferred
+LOW_BUDGET_FRACTION = 0.2
+
+DEFAULT_CREDENTIAL = 'default'
+
+
+class QuotaDeferred(Exception):
+    """A non-urgent fetch was not started because the quota budget is low"""
+
+    def __init__(self, label: str, fallback=None):
+        super().__init__(f"{label}: quota budget low, fetch deferred")
+        self.label = label
+        self.fallback = fallback
+
+
+class QuotaBudget:
+    """
+    Sliding window of API call times per credential
+
+    Args:
+        limit: Calls allowed per window and credential
+        window: Window length in seconds
+        low_fraction: is_low() when less than this share of the limit is left
+    """
+
+    def __init__(self, limit: int = SHEETS_READ_REQUESTS_PER_MINUTE, window: float = QUOTA_WINDOW_SECONDS,
+                 low_fraction: float = LOW_BUDGET_FRACTION):
+        self.limit = limit
+        self.window = window
+        self.low_fraction = low_fraction
+        self._calls = defaultdict(deque)
+        self._waited = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def _prune(self, credential: str, now: float):
+        calls = self._calls[credential]
+        while calls and calls[0] <= now - self.window:
+            calls.popleft()
+        return calls
+
+    def used(self, credential: str = DEFAULT_CREDENTIAL) -> int:
+        """Calls of the credential in the current window"""
+        with self._lock:
+            return len(self._prune(credential, time.time()))
+
+    def remaining(self, credential: str = DEFAULT_CREDENTIAL) -> int:
+        """Calls the credential can still make in the current window"""
+        return max(self.limit - self.used(credential), 0)
+
+    def is_low(self, credential: str = DEFAULT_CREDENTIAL) -> bool:
+        """Less than low_fraction of the window left - defer what can wait"""
+        return self.remaining(credential) < self.limit * self.low_fraction
+
+    def acquire(self, credential: str = DEFAULT_CREDENTIAL) -> float:
+        """
+        Take one call slot, waiting until the window has room
+
+        Returns:
+            Seconds waited (0 when the budget had room)
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                calls = self._prune(credential, now)
+                if len(calls) < self.limit:
+                    calls.append(now)
+                    self._waited[credential] += waited
+                    return waited
+                delay = calls[0] + self.window - now
+            delay = max(delay, 0.05)
+            time.sleep(delay)
+            waited += delay
+
+    def snapshot(self) -> dict:
+        """{credential: {'used', 'remaining', 'limit', 'waited_seconds'}} of every credential seen"""
+        with self._lock:
+            now = time.time()
+            snapshot = {}
+            for credential in list(self._calls):
+                used = len(self._prune(credential, now))
+                snapshot[credential] = {
+                    'used': used,
+                    'remaining': max(self.limit - used, 0),
+                    'limit': self.limit,
+                    'waited_seconds': self._waited[credential],
+                }
+            return snapshot
+
+    def instrument_client(self, client, credential: str = None):
+        """
+        Pace every request of a gspread client (gspread 5 / 6 sessions) on this budget
+
+        Returns:
+            client (requests go through acquire(credential) first)
+        """
+        http_client = getattr(client, 'http_client', None)
+        session = getattr(http_client, 'session', None) or getattr(client, 'session', None)
+        if session is None or getattr(session, 'quota_credential', None) is not None:
+            return client
+
+        credential = credential or DEFAULT_CREDENTIAL
+        send = session.request
+
+        def request(*args, **kwargs):
+            self.acquire(credential)
+            return send(*args, **kwargs)
+
+        session.request = request
+        session.quota_credential = credential
+        return client
+
+
+def client_credential(client) -> str:
+    """Credential a client was instrumented with (DEFAULT_CREDENTIAL if none)"""
+    http_client = getattr(client, 'http_client', None)
+    session = getattr(http_client, 'session', None) or getattr(client, 'session', None)
+    return getattr(session, 'quota_credential', None) or DEFAULT_CREDENTIAL
+
+
+def credentials_id(creds) -> str:
+    """Quota key of google.auth credentials (service account email)"""
+    return getattr(creds, 'service_account_email', None) or DEFAULT_CREDENTIAL
+
+
+# Process-wide budget shared by every client of the process
+sheets_budget = QuotaBudget()
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Sheet Sources
+Google Sheets worksheets used by the reports and how each one becomes a DataFrame
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from date_parsing import parse_dates
+from day_index import sort_by_day
+from khsx_order_flags import add_order_flags
+from qc_capacity_helper import build_hr_head_count_table
+from quota_budget import credentials_id, sheets_budget
+
+
+DEFAULT_SHEET_URL = 'https://docs.google.com/spreadsheets/d/1F2NzTR50kXzGx9Pc5KdBwwqnIRXGvViPv6mgw8YMNW0/edit'
+DEFAULT_CREDENTIALS_FILE = 'api-agent-471608-912673253587.json'
+SHEETS_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Sheet key (load_all_data_parallel) -> worksheet and parsing rules
+# - header_row: 0-based row holding the column names, data starts on the next row
+# - required_column: rows with an empty value are dropped
+# - date_column: (raw column, parsed column), parsed with '%d/%m/%Y'
+# - sort_by_day: rows put in day order (day_index.build_day_index)
+# - batch_rows: read in row batches instead of one get_all_values (large sheets)
+SHEET_SOURCES = {
+    'GCKT_GPKT': {
+        'worksheet': 'GCKT_GPKT',
+        'label': 'GCKT_GPKT',
+        'required_column': 'so_file',
+        'date_column': ('ngay_giao', 'ngay_giao_parsed'),
+        'sort_by_day': True,
+        'batch_rows': 1000,
+    },
+    'PKY': {
+        'worksheet': 'pky',
+        'label': 'PKY',
+    },
+    'PHTCV': {
+        'worksheet': 'PHTCV',
+        'label': 'PHTCV',
+        'date_column': ('ngày tháng', 'date_parsed'),
+        'sort_by_day': True,
+    },
+    'machine_list': {
+        'worksheet': 'machine_list',
+        'label': 'machine_list',
+    },
+    'giao_kho_vp': {
+        'worksheet': 'giao_kho_vp',
+        'label': 'giao_kho_vp',
+        'date_column': ('ngay_dong_goi', 'ngay_dong_goi_parsed'),
+        'sort_by_day': True,
+    },
+    'shift_schedule': {
+        'worksheet': '__SHIFT__Shift Schedule',
+        'label': 'Shift Schedule',
+        'date_column': ('Work Date', 'Work Date Parsed'),
+    },
+    'hr_daily_head_counts': {
+        'worksheet': '__HR_SYSTEM__Daily Head Counts',
+        'label': 'HR Daily Head Counts',
+        'date_column': ('Working Date', 'Working Date Parsed'),
+        'finalize': build_hr_head_count_table,  # numeric table indexed by (Department ID, Working Date)
+    },
+    'thoi_gian_hoan_thanh': {
+        'worksheet': 'thoi_gian_hoan_thanh',
+        'label': 'thoi_gian_hoan_thanh',
+    },
+    'KHSX': {
+        'worksheet': 'KHSX_KHSX',
+        'label': 'KHSX_KHSX',
+        'header_row': 3,  # header dòng 4, dữ liệu từ dòng 5
+        'finalize': add_order_flags,
+    },
+}
+
+QUOTA_ERROR_MARKERS = ('quota', 'rate limit', 'too many requests')
+
+SNAPSHOT_MANIFEST = 'manifest.json'
+
+# DataFrame.attrs key of the content version set by build_sheet_frame
+SHEET_VERSION_ATTR = 'sheet_version'
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Sheets API quota / rate limit error"""
+    error_msg = str(error).lower()
+    return any(marker in error_msg for marker in QUOTA_ERROR_MARKERS)
+
+
+def call_with_backoff(func, max_retries=5, initial_delay=1, on_retry=None, on_give_up=None):
+    """
+    Call func, retrying with exponential backoff on quota errors
+
+    Args:
+        func: Function to call
+        max_retries: Maximum number of attempts
+        initial_delay: Initial delay in seconds (doubled each retry)
+        on_retry: Optional callback(delay, attempt, max_retries) before waiting
+        on_give_up: Optional callback(max_retries) when the last attempt failed
+
+    Returns:
+        Result of the function call (other errors are raised immediately)
+    """
+    for attempt in range(max_retries):
+        try:
+            result = func()
+            # Add small delay between successful calls to avoid hitting quota
+            time.sleep(0.5)
+            return result
+        except Exception as e:
+            if not is_quota_error(e):
+                raise
+            if attempt < max_retries - 1:
+                delay = initial_delay * (2 ** attempt)
+                if on_retry is not None:
+                    on_retry(delay, attempt + 1, max_retries)
+                time.sleep(delay)
+                continue
+            if on_give_up is not None:
+                on_give_up(max_retries)
+            raise
+
+    return None
+
+
+def build_sheet_frame(sheet: str, values: list) -> pd.DataFrame:
+    """
+    Parse the cell values of one worksheet per its SHEET_SOURCES rules
+
+    Args:
+        sheet: SHEET_SOURCES key
+        values: Rows of cell strings, header rows included (get_all_values)
+
+    Returns:
+        Parsed DataFrame (empty if the sheet has no data row)
+    """
+    source = SHEET_SOURCES[sheet]
+    header_row = source.get('header_row', 0)
+    if not values or len(values) <= header_row + 1:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(values[header_row + 1:], columns=values[header_row])
+
+    required_column = source.get('required_column')
+    if required_column and required_column in df.columns:
+        df = df[df[required_column].notna() & (df[required_column].str.strip() != '')].copy()
+
+    date_column = source.get('date_column')
+    if date_column and date_column[0] in df.columns:
+        raw_column, parsed_column = date_column
+        # Parse dates ONCE at load time
+        df[parsed_column] = parse_dates(df[raw_column], format='%d/%m/%Y')
+        if source.get('sort_by_day'):
+            df = sort_by_day(df, parsed_column)  # Day order for build_day_index
+
+    finalize = source.get('finalize')
+    if finalize is not None:
+        df = finalize(df)
+
+    # Hashed once per load, so data versions are free on every rerun
+    df.attrs[SHEET_VERSION_ATTR] = hash_sheet_rows(df)
+    return df
+
+
+def hash_sheet_rows(df: pd.DataFrame) -> str:
+    """Content hash of a frame (rows, index and row count), '0' * 16 if missing / empty"""
+    if df is None or len(df) == 0:
+        return '0' * 16
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy(dtype='uint64')
+    return f"{int(row_hashes.sum(dtype='uint64')) ^ len(df):016x}"
+
+
+def sheet_version(df: pd.DataFrame) -> str:
+    """Content version of a loaded sheet (stamped by build_sheet_frame, hashed otherwise)"""
+    if df is not None and SHEET_VERSION_ATTR in df.attrs:
+        return df.attrs[SHEET_VERSION_ATTR]
+    return hash_sheet_rows(df)
+
+
+def read_sheet_values(worksheet, batch_rows: int = None, retry=call_with_backoff,
+                      on_batch_error=None) -> list:
+    """
+    All cell values of a worksheet (header rows included)
+
+    Args:
+        worksheet: gspread Worksheet
+        batch_rows: If set, read batch_rows rows per request (avoids timeouts on large sheets)
+        retry: Wrapper applied to every API call, e.g. call_with_backoff
+        on_batch_error: Optional callback(start_row, end_row, error); the batch is
+            skipped when given, otherwise the error is raised
+    """
+    if not batch_rows:
+        return retry(lambda: worksheet.get_all_values())
+
+    from gspread.utils import rowcol_to_a1
+
+    row_count = worksheet.row_count
+    col_count = worksheet.col_count
+
+    # Header first, then batch_rows rows per request
+    values = [retry(lambda: worksheet.row_values(1))]
+    for start_row in range(2, row_count + 1, batch_rows):
+        end_row = min(start_row + batch_rows - 1, row_count)
+        cell_range = f'A{start_row}:{rowcol_to_a1(end_row, col_count)}'
+        try:
+            batch_data = retry(lambda: worksheet.get_values(cell_range))
+            if batch_data:
+                values.extend(batch_data)
+
+            # Add delay between batches to avoid quota
+            time.sleep(1)
+        except Exception as batch_error:
+            if on_batch_error is None:
+                raise
+            on_batch_error(start_row, end_row, batch_error)
+    return values
+
+
+def read_sheet(client, sheet_url: str, sheet: str, retry=call_with_backoff,
+               on_batch_error=None) -> pd.DataFrame:
+    """
+    Read and parse one sheet live
+
+    Args:
+        client: Authorized gspread client
+        sheet_url: Spreadsheet URL
+        sheet: SHEET_SOURCES key
+        retry, on_batch_error: See read_sheet_values
+    """
+    source = SHEET_SOURCES[sheet]
+    worksheet = client.open_by_url(sheet_url).worksheet(source['worksheet'])
+    values = read_sheet_values(
+        worksheet, source.get('batch_rows'), retry=retry, on_batch_error=on_batch_error
+    )
+    return build_sheet_frame(sheet, values)
+
+
+def authorize_service_account(credentials_file: str):
+    """gspread client authorized with a service account JSON key file (paced by the quota budget)"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_file(credentials_file, scopes=SHEETS_SCOPES)
+    return sheets_budget.instrument_client(gspread.authorize(creds), credentials_id(creds))
+
+
+def load_sheets(client, sheet_url: str = DEFAULT_SHEET_URL, sheets=None, max_workers: int = 3,
+                retry=call_with_backoff, on_loaded=None) -> dict:
+    """
+    Read several sheets live in parallel
+
+    Args:
+        client: Authorized gspread client
+        sheets: SHEET_SOURCES keys (default: all)
+        max_workers: Concurrent reads (kept low to stay under the Sheets API quota)
+        on_loaded: Optional callback(sheet, frame_or_None, error_or_None) per finished sheet
+
+    Returns:
+        {sheet: DataFrame}, None for the sheets that failed
+    """
+    sheets = list(SHEET_SOURCES) if sheets is None else list(sheets)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(read_sheet, client, sheet_url, sheet, retry): sheet
+            for sheet in sheets
+        }
+        for future in as_completed(futures):
+            sheet = futures[future]
+            try:
+                results[sheet] = future.result()
+                error = None
+            except Exception as e:
+                results[sheet] = None
+                error = e
+            if on_loaded is not None:
+                on_loaded(sheet, results[sheet], error)
+    return results
+
+
+def save_snapshot(data: dict, directory: str) -> dict:
+    """
+    Write loaded frames to a snapshot directory (one pickle per sheet + manifest.json)
+
+    Pickles keep the parsed dtypes / indexes, so a snapshot loads ready to use.
+    Only load snapshots written by this function (pickle is not safe for untrusted files).
+
+    Returns:
+        The manifest ({'saved_at', 'sheets': {sheet: rows}})
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'saved_at': datetime.now().isoformat(timespec='seconds'), 'sheets': {}}
+    for sheet, df in data.items():
+        if df is None:
+            continue
+        df.to_pickle(os.path.join(directory, f'{sheet}.pkl'))
+        manifest['sheets'][sheet] = int(len(df))
+
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_snapshot(directory: str) -> dict:
+    """
+    Read a snapshot written by save_snapshot
+
+    Returns:
+        {sheet: DataFrame} for every SHEET_SOURCES key (None if not in the snapshot)
+    """
+    manifest_path = os.path.join(directory, SNAPSHOT_MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"Không tìm thấy snapshot: {manifest_path}")
+
+    data = {}
+    for sheet in SHEET_SOURCES:
+        path = os.path.join(directory, f'{sheet}.pkl')
+        data[sheet] = pd.read_pickle(path) if os.path.exists(path) else None
+    return data
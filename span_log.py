@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Span Log
+Structured timing spans of the load / compute stages, as JSON lines in a rotating file
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+
+DEFAULT_SPAN_LOG_FILE = os.path.join('logs', 'spans.jsonl')
+SPAN_LOG_MAX_BYTES = 10 * 1024 * 1024
+SPAN_LOG_BACKUP_COUNT = 5
+
+logger = logging.getLogger('span_log')
+logger.propagate = False  # spans only go to the JSON-lines file
+
+_context = threading.local()
+_configure_lock = threading.Lock()
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.span, ensure_ascii=False, default=str)
+
+
+def configure_span_log(path: str = DEFAULT_SPAN_LOG_FILE, max_bytes: int = SPAN_LOG_MAX_BYTES,
+                       backup_count: int = SPAN_LOG_BACKUP_COUNT):
+    """
+    Write spans to path, rotated at max_bytes (backup_count old files kept)
+
+    Safe to call on every rerun - the file handler is only added once per path.
+    """
+    path = os.path.abspath(path)
+    with _configure_lock:
+        for handler in logger.handlers:
+            if getattr(handler, 'baseFilename', None) == path:
+                return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        handler.setFormatter(_JsonLineFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+def enabled() -> bool:
+    """Spans are no-ops until configure_span_log is called (library callers write nothing)"""
+    return bool(logger.handlers)
+
+
+@contextmanager
+def span_context(**attrs):
+    """Default span attributes (e.g. session_id) for the spans of this thread inside the block"""
+    previous = getattr(_context, 'attrs', {})
+    _context.attrs = {**previous, **attrs}
+    try:
+        yield
+    finally:
+        _context.attrs = previous
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the block and write one span line
+
+    Yields the attribute dict, so the block can add what it only knows at the end
+    ('rows', 'cache'). An exception is recorded (status 'error') and re-raised.
+    """
+    if not enabled():
+        yield attrs
+        return
+
+    started = datetime.now()
+    start = time.perf_counter()
+    status = 'ok'
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        status = 'error'
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record = {
+            'ts': started.isoformat(timespec='milliseconds'),
+            'span': name,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+            **getattr(_context, 'attrs', {}),
+            **attrs,
+            'status': status,
+        }
+        if error is not None:
+            record['error'] = error
+        record.setdefault('thread', threading.current_thread().name)
+        logger.info(name, extra={'span': record})
+
+
+def traced(name: str = None, rows_arg: str = None, **attrs):
+    """
+    Decorator: one span per call
+
+    Args:
+        name: Span name (default: function name)
+        rows_arg: Argument whose len() is logged as 'rows' (input size)
+        attrs: Constant span attributes
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func) if rows_arg else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            span_attrs = dict(attrs)
+            if signature is not None:
+                value = signature.bind_partial(*args, **kwargs).arguments.get(rows_arg)
+                span_attrs['rows'] = len(value) if value is not None else None
+            with span(span_name, **span_attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental daily KPI store (run from the repo root: python -m pytest)
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from daily_kpi_store import (
+    DEPARTMENT_SX,
+    KPI_COLUMNS,
+    build_day_fingerprints,
+    changed_days,
+    empty_kpi_store,
+    hash_rows_by_day,
+    load_kpi_store,
+    refresh_daily_kpis,
+    save_kpi_store,
+)
+
+
+TODAY = pd.Timestamp('2025-03-10')
+
+
+def make_source(days=pd.date_range('2025-03-01', '2025-03-10')) -> pd.DataFrame:
+    """Two source rows per day (like GCKT deliveries)"""
+    return pd.DataFrame({
+        'date': list(days) * 2,
+        'sl_giao': [10.0 * (i + 1) for i in range(len(days))] * 2,
+    })
+
+
+def fingerprints_of(source: pd.DataFrame) -> pd.Series:
+    return build_day_fingerprints([hash_rows_by_day(source, source['date'])])
+
+
+class Computer:
+    """compute callable of refresh_daily_kpis: daily Sản lượng of the source, records the days asked"""
+
+    def __init__(self, source: pd.DataFrame):
+        self.source = source
+        self.calls = []
+
+    def __call__(self, stale_days):
+        self.calls.append(pd.DatetimeIndex(stale_days))
+        rows = self.source[self.source['date'].isin(stale_days)]
+        kpis = rows.groupby('date', as_index=False)['sl_giao'].sum().rename(columns={'sl_giao': 'san_luong'})
+        kpis['cs_tong'] = kpis['san_luong'] / 10
+        return kpis
+
+
+def kpi_values(store: pd.DataFrame) -> pd.DataFrame:
+    return store[['date', 'department'] + KPI_COLUMNS].reset_index(drop=True)
+
+
+def test_changed_days_added_removed_edited():
+    previous = pd.Series(['a', 'b', 'c'], index=pd.to_datetime(['2025-03-01', '2025-03-02', '2025-03-03']))
+    current = pd.Series(['a', 'B', 'd'], index=pd.to_datetime(['2025-03-01', '2025-03-02', '2025-03-04']))
+
+    changed = changed_days(previous, current)
+
+    assert list(changed) == list(pd.to_datetime(['2025-03-02', '2025-03-03', '2025-03-04']))
+
+
+def test_refresh_is_a_noop_for_the_same_data_version():
+    source = make_source()
+    compute = Computer(source)
+    store, recomputed = refresh_daily_kpis(empty_kpi_store(), DEPARTMENT_SX, fingerprints_of(source), compute, today=TODAY)
+    assert len(recomputed) == len(source['date'].unique())
+
+    again, recomputed = refresh_daily_kpis(store, DEPARTMENT_SX, fingerprints_of(source), compute, today=TODAY)
+
+    assert again is store
+    assert len(recomputed) == 0
+    assert len(compute.calls) == 1
+
+
+def test_editing_one_day_recomputes_that_day_and_today():
+    source = make_source()
+    store, _ = refresh_daily_kpis(empty_kpi_store(), DEPARTMENT_SX, fingerprints_of(source), Computer(source), today=TODAY)
+
+    edited = source.copy()
+    edited.loc[edited['date'] == pd.Timestamp('2025-03-04'), 'sl_giao'] += 5
+    compute = Computer(edited)
+    store, recomputed = refresh_daily_kpis(store, DEPARTMENT_SX, fingerprints_of(edited), compute, today=TODAY)
+
+    assert list(recomputed) == [pd.Timestamp('2025-03-04'), TODAY]
+    assert list(compute.calls[0]) == list(recomputed)
+
+    # Same rows as a full rebuild from an empty store
+    rebuilt, _ = refresh_daily_kpis(empty_kpi_store(), DEPARTMENT_SX, fingerprints_of(edited), Computer(edited), today=TODAY)
+    pd.testing.assert_frame_equal(kpi_values(store), kpi_values(rebuilt), check_dtype=False)
+
+
+def test_days_without_source_rows_are_dropped():
+    source = make_source()
+    store, _ = refresh_daily_kpis(empty_kpi_store(), DEPARTMENT_SX, fingerprints_of(source), Computer(source), today=TODAY)
+
+    shrunk = source[source['date'] != pd.Timestamp('2025-03-02')]
+    store, recomputed = refresh_daily_kpis(store, DEPARTMENT_SX, fingerprints_of(shrunk), Computer(shrunk), today=TODAY)
+
+    assert pd.Timestamp('2025-03-02') not in set(store['date'])
+    assert list(recomputed) == [TODAY]
+
+
+def test_load_reuses_the_saved_frame_until_the_file_changes(tmp_path):
+    path = str(tmp_path / 'daily_kpis.csv')
+    source = make_source()
+    store, _ = refresh_daily_kpis(empty_kpi_store(), DEPARTMENT_SX, fingerprints_of(source), Computer(source), today=TODAY)
+    save_kpi_store(store, path)
+
+    # Unchanged file: the saved frame itself, refreshed version included
+    assert load_kpi_store(path) is store
+
+    # Changed on disk (another process): parsed again
+    edited = store.iloc[:3].copy()
+    edited.to_csv(path, index=False, date_format='%Y-%m-%d')
+    reloaded = load_kpi_store(path)
+    assert reloaded is not store
+    assert len(reloaded) == 3
+    assert load_kpi_store(path) is reloaded
+
+
+@pytest.mark.parametrize('content', [None, 'date,other\n2025-03-01,1\n'])
+def test_load_missing_or_old_layout_is_an_empty_store(tmp_path, content):
+    path = str(tmp_path / 'daily_kpis.csv')
+    if content is not None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    store = load_kpi_store(path)
+
+    assert store.empty
+    assert os.path.exists(path) == (content is not None)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of kpi_trends (run from the repo root: python -m pytest)
+"""
+
+import pandas as pd
+import pytest
+
+from daily_kpi_store import DEPARTMENT_SX, KPI_COLUMNS, KPI_STORE_COLUMNS
+from kpi_trends import PREVIOUS_YEAR_SUFFIX, build_kpi_trend
+
+
+def make_store(start_date, end_date) -> pd.DataFrame:
+    """KPI store with one SX row per day of [start_date, end_date]"""
+    store = pd.DataFrame({'date': pd.date_range(start_date, end_date)})
+    store['department'] = DEPARTMENT_SX
+    for column in KPI_COLUMNS:
+        store[column] = 80.0
+    store['source_hash'] = '0'
+    store['computed_at'] = pd.Timestamp('2025-03-01')
+    return store[KPI_STORE_COLUMNS]
+
+
+@pytest.mark.parametrize('granularity', ['D', 'W', 'M'])
+def test_previous_year_without_stored_rows(granularity):
+    # First year of the store: nothing one year earlier to compare with
+    store = make_store('2025-02-01', '2025-02-28')
+
+    trend = build_kpi_trend(
+        store, DEPARTMENT_SX, '2025-02-01', '2025-02-28',
+        granularity=granularity, compare_previous_year=True
+    )['trend']
+
+    assert not trend.empty
+    for column in ('cs_tong', 'cs_truc_tiep', 'san_luong'):
+        assert trend[column + PREVIOUS_YEAR_SUFFIX].isna().all()
+
+
+@pytest.mark.parametrize('granularity', ['D', 'W', 'M'])
+def test_previous_year_with_stored_rows(granularity):
+    store = make_store('2024-01-01', '2025-02-28')
+
+    trend = build_kpi_trend(
+        store, DEPARTMENT_SX, '2025-02-01', '2025-02-28',
+        granularity=granularity, compare_previous_year=True
+    )['trend']
+
+    assert (trend['cs_tong' + PREVIOUS_YEAR_SUFFIX] == 80.0).all()
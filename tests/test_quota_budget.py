@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sliding-window Sheets quota budget (run from the repo root: python -m pytest)
+"""
+
+import time
+from types import SimpleNamespace
+
+from quota_budget import DEFAULT_CREDENTIAL, QuotaBudget, client_credential
+
+
+def test_acquire_waits_for_the_oldest_call_to_leave_the_window():
+    budget = QuotaBudget(limit=3, window=1.0)
+    start = time.monotonic()
+    waits = [budget.acquire('sa') for _ in range(4)]
+    elapsed = time.monotonic() - start
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 0.9 <= waits[3] <= 1.5
+    assert 0.9 <= elapsed <= 1.5
+    assert budget.snapshot()['sa']['waited_seconds'] == waits[3]
+
+
+def test_credentials_have_separate_windows():
+    budget = QuotaBudget(limit=2, window=60)
+    budget.acquire('sa-1')
+    budget.acquire('sa-1')
+
+    assert budget.remaining('sa-1') == 0
+    assert budget.remaining('sa-2') == 2
+    assert budget.acquire('sa-2') == 0.0
+
+
+def test_is_low_below_the_reserved_fraction():
+    budget = QuotaBudget(limit=10, window=60, low_fraction=0.2)
+    for _ in range(8):
+        budget.acquire('sa')
+    assert not budget.is_low('sa')  # 2 left = 20%
+
+    budget.acquire('sa')
+    assert budget.is_low('sa')
+    assert budget.used('sa') == 9
+
+
+def test_calls_leave_the_window():
+    budget = QuotaBudget(limit=2, window=0.2)
+    budget.acquire('sa')
+    budget.acquire('sa')
+    assert budget.remaining('sa') == 0
+
+    time.sleep(0.25)
+    assert budget.remaining('sa') == 2
+
+
+def test_instrument_client_paces_every_request():
+    sent = []
+    session = SimpleNamespace(request=lambda method, url: sent.append((method, url)) or 'response')
+    client = SimpleNamespace(http_client=SimpleNamespace(session=session))
+    budget = QuotaBudget(limit=5, window=60)
+
+    budget.instrument_client(client, 'sa')
+    budget.instrument_client(client, 'other')  # already instrumented: kept on 'sa'
+    for _ in range(3):
+        assert session.request('GET', 'https://sheets') == 'response'
+
+    assert len(sent) == 3
+    assert budget.used('sa') == 3
+    assert budget.used('other') == 0
+    assert client_credential(client) == 'sa'
+    assert client_credential(SimpleNamespace()) == DEFAULT_CREDENTIAL
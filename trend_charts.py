@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Trend Charts
+Plotly figures of the Công suất trend charts (Sản xuất / Kiểm tra AMJ)
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+
+LABEL_ALL_MAX_POINTS = 40
+LABEL_THIN_MAX_POINTS = 200
+
+# Line colors per chart: (CS tổng, CS trực tiếp, Sản lượng)
+TREND_CHART_COLORS = {
+    'san_xuat': ('#2ecc71', '#9b59b6', '#e74c3c'),
+    'kiem_tra': ('#3498db', '#e74c3c', '#2ecc71'),
+}
+
+
+def thinned_labels(values: pd.Series) -> list:
+    """
+    Text labels of the Sản lượng points ('1,234'), thinned by point count
+
+    Returns:
+        One label per point: all points up to LABEL_ALL_MAX_POINTS, every n-th point
+        (about LABEL_ALL_MAX_POINTS labels, last point included) up to
+        LABEL_THIN_MAX_POINTS, '' everywhere past that
+    """
+    count = len(values)
+    if count == 0 or count > LABEL_THIN_MAX_POINTS:
+        return [''] * count
+
+    step = -(-count // LABEL_ALL_MAX_POINTS)
+    shown = np.zeros(count, dtype=bool)
+    shown[::step] = True
+    shown[-1] = True
+
+    numbers = pd.to_numeric(values, errors='coerce').fillna(0).round().astype('int64').to_numpy()
+    return [f"{number:,}" if show else '' for number, show in zip(numbers, shown)]
+
+
+def build_trend_figure(df_trend: pd.DataFrame, chart: str, title: str, xaxis_title: str) -> go.Figure:
+    """
+    CS tổng / CS trực tiếp (%) lines + Sản lượng points on a secondary axis
+
+    Args:
+        df_trend: Trend rows with 'date_str', 'CS tổng', 'CS trực tiếp', 'Sản lượng'
+            (+ 'CS tổng năm trước' / 'CS trực tiếp năm trước' when comparing)
+        chart: TREND_CHART_COLORS key
+        title: Chart title
+        xaxis_title: Rollup label (Ngày / Tuần / Tháng)
+    """
+    color_tong, color_truc_tiep, color_san_luong = TREND_CHART_COLORS[chart]
+    x = df_trend['date_str']
+
+    # Create figure with secondary y-axis
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+    fig.add_trace(go.Scattergl(
+        x=x,
+        y=df_trend['CS tổng'],
+        mode='lines+markers',
+        name='CS tổng (%)',
+        line=dict(color=color_tong, width=2),
+        marker=dict(size=6)
+    ), secondary_y=False)
+
+    fig.add_trace(go.Scattergl(
+        x=x,
+        y=df_trend['CS trực tiếp'],
+        mode='lines+markers',
+        name='CS trực tiếp (%)',
+        line=dict(color=color_truc_tiep, width=2),
+        marker=dict(size=6)
+    ), secondary_y=False)
+
+    # Cùng kỳ năm trước (dashed)
+    if 'CS tổng năm trước' in df_trend.columns:
+        fig.add_trace(go.Scattergl(
+            x=x,
+            y=df_trend['CS tổng năm trước'],
+            mode='lines',
+            name='CS tổng năm trước (%)',
+            line=dict(color=color_tong, width=1, dash='dash')
+        ), secondary_y=False)
+        fig.add_trace(go.Scattergl(
+            x=x,
+            y=df_trend['CS trực tiếp năm trước'],
+            mode='lines',
+            name='CS trực tiếp năm trước (%)',
+            line=dict(color=color_truc_tiep, width=1, dash='dash')
+        ), secondary_y=False)
+
+    # Sản lượng (secondary y-axis) - values only (no line), labels thinned on long ranges
+    labels = thinned_labels(df_trend['Sản lượng'])
+    fig.add_trace(go.Scattergl(
+        x=x,
+        y=df_trend['Sản lượng'],
+        mode='markers+text' if any(labels) else 'markers',
+        text=labels if any(labels) else None,
+        textposition='top center',
+        hovertemplate='%{y:,.0f}',
+        name='Sản lượng',
+        marker=dict(size=8, symbol='diamond', color=color_san_luong)
+    ), secondary_y=True)
+
+    fig.update_layout(
+        title=title,
+        xaxis_title=xaxis_title,
+        hovermode='x unified',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        height=400
+    )
+
+    max_y = max(df_trend['CS tổng'].max(), df_trend['CS trực tiếp'].max(), 100)
+    fig.update_yaxes(title_text="Công suất (%)", secondary_y=False, range=[0, max_y + 20])
+    fig.update_yaxes(title_text="Sản lượng", secondary_y=True)
+    return fig